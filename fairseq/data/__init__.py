@@ -45,6 +45,7 @@ from .padding_mask_dataset import (
     RightPaddingMaskDataset,
 )
 from .pad_dataset import LeftPadDataset, PadDataset, RightPadDataset
+from .prepend_concat_truncate_dataset import PrependConcatTruncateDataset
 from .prepend_dataset import PrependDataset
 from .prepend_token_dataset import PrependTokenDataset
 from .raw_label_dataset import RawLabelDataset
@@ -112,6 +113,7 @@ __all__ = [
     "NumSamplesDataset",
     "OffsetTokensDataset",
     "PadDataset",
+    "PrependConcatTruncateDataset",
     "PrependDataset",
     "PrependTokenDataset",
     "RandomCropDataset",
@@ -3,7 +3,6 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import itertools
 import logging
 import os
 import sys
@@ -68,8 +67,9 @@ def load_label_offset(label_path, inds, tot):
         assert (
             len(code_lengths) == tot
         ), f"number of labels does not match ({len(code_lengths)} != {tot})"
-        offsets = list(itertools.accumulate([0] + code_lengths))
-        offsets = [(offsets[i], offsets[i + 1]) for i in inds]
+        offsets = np.cumsum([0] + code_lengths, dtype=np.int64)
+        inds = np.asarray(inds, dtype=np.int64)
+        offsets = np.stack([offsets[inds], offsets[inds + 1]], axis=1)
     return offsets
 
 
@@ -132,9 +132,10 @@ class HubertDataset(FairseqDataset):
         random_crop: bool = False,
         single_target: bool = False,
     ):
-        self.audio_root, self.audio_names, inds, tot, self.sizes = load_audio(
+        self.audio_root, self.audio_names, inds, tot, sizes = load_audio(
             manifest_path, max_keep_sample_size, min_keep_sample_size
         )
+        self.sizes = np.array(sizes, dtype=np.int64)
         self.sample_rate = sample_rate
         self.shuffle = shuffle
         self.random_crop = random_crop
@@ -195,8 +196,8 @@ class HubertDataset(FairseqDataset):
         else:
             with open(self.label_paths[label_idx]) as f:
                 offset_s, offset_e = self.label_offsets_list[label_idx][index]
-                f.seek(offset_s)
-                label = f.read(offset_e - offset_s)
+                f.seek(int(offset_s))
+                label = f.read(int(offset_e - offset_s))
 
         if self.label_processors is not None:
             label = self.label_processors[label_idx](label)
@@ -278,7 +279,8 @@ class HubertDataset(FairseqDataset):
                 collated_audios[i] = audio
             elif diff < 0:
                 assert self.pad_audio
-                collated_audios[i] = torch.cat([audio, audio.new_full((-diff,), 0.0)])
+                # collated_audios is zero-initialized, so only copy the audio
+                collated_audios[i, : len(audio)] = audio
                 padding_mask[i, diff:] = True
             else:
                 collated_audios[i], audio_starts[i] = self.crop_to_max_size(
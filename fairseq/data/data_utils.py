@@ -11,6 +11,7 @@ import contextlib
 import itertools
 import logging
 import re
+import threading
 import warnings
 from typing import Optional, Tuple
 
@@ -124,21 +125,39 @@ def load_indexed_dataset(
         return ConcatDataset(datasets)
 
 
+# The NumPy PRNG is shared by all threads (e.g. fairseq-validate loads the next
+# subset in a background thread), so seeded sections must not interleave.
+_numpy_seed_lock = threading.RLock()
+
+
+def _reset_numpy_seed_lock():
+    global _numpy_seed_lock
+    # a forked child (e.g. a DataLoader worker) does not inherit the thread that
+    # may have been holding the lock
+    _numpy_seed_lock = threading.RLock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_numpy_seed_lock)
+
+
 @contextlib.contextmanager
 def numpy_seed(seed, *addl_seeds):
     """Context manager which seeds the NumPy PRNG with the specified seed and
-    restores the state afterward"""
+    restores the state afterward. Seeded sections in different threads run one
+    at a time."""
     if seed is None:
         yield
         return
     if len(addl_seeds) > 0:
         seed = int(hash((seed, *addl_seeds)) % 1e6)
-    state = np.random.get_state()
-    np.random.seed(seed)
-    try:
-        yield
-    finally:
-        np.random.set_state(state)
+    with _numpy_seed_lock:
+        state = np.random.get_state()
+        np.random.seed(seed)
+        try:
+            yield
+        finally:
+            np.random.set_state(state)
 
 
 def collect_filtered(function, iterable, filtered):
@@ -871,6 +871,7 @@ class GroupedEpochBatchIterator(EpochBatchIterator):
             collate_fn=self.collate_fn,
             batch_sampler=batches[offset:],
             num_workers=self.num_workers,
+            pin_memory=True,
             persistent_workers=self.persistent_workers,
         )
         if self.buffer_size > 0:
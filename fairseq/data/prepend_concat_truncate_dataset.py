@@ -0,0 +1,103 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+
+from . import FairseqDataset
+
+
+class PrependConcatTruncateDataset(FairseqDataset):
+    """Concatenates items of *first* and *second*, optionally prepending
+    *prepend_token* to *first*, truncating the result to *max_len* tokens and
+    putting *sep_token* in front of *second*.
+
+    This is equivalent to::
+
+        ConcatSentencesDataset(
+            TruncateDataset(PrependTokenDataset(first, prepend_token), max_len),
+            PrependTokenDataset(second, sep_token),
+        )
+
+    but builds each item with a single allocation instead of one per wrapper.
+
+    Args:
+        first (~fairseq.data.FairseqDataset): dataset placed first
+        second (~fairseq.data.FairseqDataset): dataset placed second
+        prepend_token (int, optional): token added in front of *first*
+        sep_token (int, optional): token added in front of *second*
+        max_len (int, optional): maximum length of the (prepended) *first*
+            part
+    """
+
+    def __init__(self, first, second, prepend_token=None, sep_token=None, max_len=None):
+        super().__init__()
+        assert len(first) == len(second), "datasets must have the same length"
+        self.first = first
+        self.second = second
+        self.prepend_token = prepend_token
+        self.sep_token = sep_token
+        self.max_len = max_len
+
+        first_sizes = np.array(first.sizes) + int(prepend_token is not None)
+        if max_len is not None:
+            np.minimum(first_sizes, max_len, out=first_sizes)
+        self._first_sizes = first_sizes
+        self._sizes = first_sizes + np.array(second.sizes)
+        if sep_token is not None:
+            self._sizes += 1
+
+    def __getitem__(self, index):
+        first, second = self.first[index], self.second[index]
+        first_len = len(first) + int(self.prepend_token is not None)
+        if self.max_len is not None:
+            first_len = min(first_len, self.max_len)
+        second_start = first_len + int(self.sep_token is not None)
+
+        item = first.new_empty(second_start + len(second))
+        start = 0
+        if self.prepend_token is not None and first_len > 0:
+            item[0] = self.prepend_token
+            start = 1
+        item[start:first_len] = first[: first_len - start]
+        if self.sep_token is not None:
+            item[first_len] = self.sep_token
+        item[second_start:] = second
+        return item
+
+    def __len__(self):
+        return len(self.first)
+
+    def collater(self, samples):
+        return self.first.collater(samples)
+
+    @property
+    def sizes(self):
+        return self._sizes
+
+    def num_tokens(self, index):
+        return self._sizes[index]
+
+    def size(self, index):
+        return self._sizes[index]
+
+    def ordered_indices(self):
+        return self.first.ordered_indices()
+
+    @property
+    def supports_prefetch(self):
+        return any(
+            getattr(ds, "supports_prefetch", False) for ds in (self.first, self.second)
+        )
+
+    def prefetch(self, indices):
+        for ds in (self.first, self.second):
+            if getattr(ds, "supports_prefetch", False):
+                ds.prefetch(indices)
+
+    def set_epoch(self, epoch):
+        super().set_epoch(epoch)
+        for ds in (self.first, self.second):
+            if hasattr(ds, "set_epoch"):
+                ds.set_epoch(epoch)
@@ -517,6 +517,15 @@ class DatasetConfig(FairseqDataclass):
         default=False,
         metadata={"help": "do not raise error if valid subsets are ignored"},
     )
+    prefetch_valid_subsets: bool = field(
+        default=False,
+        metadata={
+            "help": "in fairseq-validate, load the next validation subset in a "
+            "background thread while the current one is evaluated (keeps two "
+            "subsets in memory at once). Results are unchanged as long as datasets "
+            "only draw random numbers under data_utils.numpy_seed while loading"
+        },
+    )
 
     validate_interval: int = field(
         default=1, metadata={"help": "validate every N epochs"}
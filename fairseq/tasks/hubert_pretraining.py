@@ -11,6 +11,7 @@ import sys
 from typing import Dict, List, Optional, Tuple
 
 import numpy as np
+import torch
 
 from dataclasses import dataclass, field
 from fairseq.data import Dictionary, HubertDataset
@@ -26,12 +27,12 @@ class LabelEncoder(object):
     def __init__(self, dictionary: Dictionary) -> None:
         self.dictionary = dictionary
 
-    def __call__(self, label: str) -> List[str]:
-        return self.dictionary.encode_line(
-            label,
-            append_eos=False,
-            add_if_not_exist=False,
-        )
+    def __call__(self, label: str) -> torch.IntTensor:
+        # same result as dictionary.encode_line(label, append_eos=False,
+        # add_if_not_exist=False), but builds the tensor from a list in one go
+        # instead of writing it one token at a time
+        indices, unk = self.dictionary.indices, self.dictionary.unk()
+        return torch.IntTensor([indices.get(tok, unk) for tok in label.split()])
 
 
 @dataclass
@@ -146,11 +147,13 @@ class HubertPretrainingTask(FairseqTask):
 
     def load_dictionaries(self):
         label_dir = self.cfg.data if self.cfg.label_dir is None else self.cfg.label_dir
-        dictionaries = [
+        if self.cfg.fine_tuning:
+            # only the first label's dictionary is used when fine-tuning
+            return Dictionary.load(f"{label_dir}/dict.{self.cfg.labels[0]}.txt")
+        return [
             Dictionary.load(f"{label_dir}/dict.{label}.txt")
             for label in self.cfg.labels
         ]
-        return dictionaries[0] if self.cfg.fine_tuning else dictionaries
 
     def get_label_dir(self) -> str:
         if self.cfg.label_dir is None:
@@ -188,4 +191,7 @@ class HubertPretrainingTask(FairseqTask):
         return (sys.maxsize, sys.maxsize)
 
     def filter_indices_by_size(self, indices: np.array, *args, **kwargs) -> np.array:
+        # max_positions() is unbounded and HubertDataset already drops
+        # too long/short utterances at load time (max/min_keep_size), so
+        # there is nothing to filter; skip the generic per-index size check
         return indices
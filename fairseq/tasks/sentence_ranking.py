@@ -9,17 +9,15 @@ import os
 import numpy as np
 from fairseq import utils
 from fairseq.data import (
-    ConcatSentencesDataset,
     Dictionary,
     IdDataset,
     NestedDictionaryDataset,
     NumelDataset,
     NumSamplesDataset,
-    PrependTokenDataset,
+    PrependConcatTruncateDataset,
     RawLabelDataset,
     RightPadDataset,
     SortDataset,
-    TruncateDataset,
     data_utils,
 )
 from fairseq.data.shorten_dataset import maybe_shorten_dataset
@@ -69,6 +67,12 @@ class SentenceRankingTask(LegacyFairseqTask):
         parser.add_argument(
             "--max-option-length", type=int, help="max length for each option"
         )
+        parser.add_argument(
+            "--cache-shuffle",
+            action="store_true",
+            help="save the shuffled sample order under the data directory and "
+            "reuse it the next time the same split is loaded with the same seed",
+        )
 
     def __init__(self, args, dictionary):
         super().__init__(args)
@@ -123,18 +127,15 @@ class SentenceRankingTask(LegacyFairseqTask):
             for idx in range(self.args.num_classes)
         ]
 
-        if self.args.separator_token is not None:
-            input0 = PrependTokenDataset(input0, self.args.separator_token)
-
         src_tokens = []
         for input_option in input_options:
-            if self.args.init_token is not None:
-                input_option = PrependTokenDataset(input_option, self.args.init_token)
-            if self.args.max_option_length is not None:
-                input_option = TruncateDataset(
-                    input_option, self.args.max_option_length
-                )
-            src_token = ConcatSentencesDataset(input_option, input0)
+            src_token = PrependConcatTruncateDataset(
+                input_option,
+                input0,
+                prepend_token=self.args.init_token,
+                sep_token=self.args.separator_token,
+                max_len=self.args.max_option_length,
+            )
             src_token = maybe_shorten_dataset(
                 src_token,
                 split,
@@ -145,9 +146,6 @@ class SentenceRankingTask(LegacyFairseqTask):
             )
             src_tokens.append(src_token)
 
-        with data_utils.numpy_seed(self.args.seed):
-            shuffle = np.random.permutation(len(src_tokens[0]))
-
         dataset = {
             "id": IdDataset(),
             "nsentences": NumSamplesDataset(),
@@ -171,15 +169,16 @@ class SentenceRankingTask(LegacyFairseqTask):
 
         label_path = "{}.label".format(get_path("label", split))
         if os.path.exists(label_path):
-            with open(label_path) as h:
-                dataset.update(
-                    target=RawLabelDataset([int(x.strip()) for x in h.readlines()])
-                )
-
-        nested_dataset = NestedDictionaryDataset(
-            dataset,
-            sizes=[np.maximum.reduce([src_token.sizes for src_token in src_tokens])],
-        )
+            labels = np.loadtxt(label_path, dtype=np.int64, ndmin=1)
+            dataset.update(target=RawLabelDataset(labels))
+
+        # fold the per-option sizes into a single buffer instead of stacking
+        # all of them for np.maximum.reduce
+        sizes = np.array(src_tokens[0].sizes)
+        for src_token in src_tokens[1:]:
+            np.maximum(sizes, src_token.sizes, out=sizes)
+
+        nested_dataset = NestedDictionaryDataset(dataset, sizes=[sizes])
 
         if self.args.no_shuffle:
             dataset = nested_dataset
@@ -187,7 +186,7 @@ class SentenceRankingTask(LegacyFairseqTask):
             dataset = SortDataset(
                 nested_dataset,
                 # shuffle
-                sort_order=[shuffle],
+                sort_order=[self._shuffle_order(split, len(src_tokens[0]))],
             )
 
         logger.info("Loaded {0} with #samples: {1}".format(split, len(dataset)))
@@ -195,6 +194,28 @@ class SentenceRankingTask(LegacyFairseqTask):
         self.datasets[split] = dataset
         return self.datasets[split]
 
+    def _shuffle_order(self, split, num_samples):
+        if not getattr(self.args, "cache_shuffle", False):
+            with data_utils.numpy_seed(self.args.seed):
+                return np.random.permutation(num_samples)
+
+        cache_path = os.path.join(
+            self.args.data,
+            "shuffle.{}.{}.{}.npy".format(self.args.seed, split, num_samples),
+        )
+        if os.path.exists(cache_path):
+            return np.load(cache_path, mmap_mode="r")
+
+        with data_utils.numpy_seed(self.args.seed):
+            shuffle = np.random.permutation(num_samples)
+        # write to a temporary file first so that concurrent readers never see
+        # a partially written cache
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.save(f, shuffle)
+        os.replace(tmp_path, cache_path)
+        return shuffle
+
     def build_model(self, args, from_checkpoint=False):
         from fairseq import models
 
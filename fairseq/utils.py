@@ -115,6 +115,35 @@ def move_to_cuda(sample, device=None):
     return apply_to_sample(_move_to_cuda, sample)
 
 
+def fast_move_to_cuda(sample, device=None):
+    """Same as :func:`move_to_cuda`, but packs all CPU tensors of a given dtype
+    into a single pinned staging buffer, so that a sample needs one
+    host-to-device copy per dtype instead of one per tensor. The returned
+    tensors are views into the copied buffer."""
+    device = device or torch.cuda.current_device()
+
+    by_dtype = collections.defaultdict(dict)
+
+    def _collect(tensor):
+        if not tensor.is_cuda:
+            by_dtype[tensor.dtype][id(tensor)] = tensor
+        return tensor
+
+    apply_to_sample(_collect, sample)
+
+    moved = {}
+    for dtype, tensors in by_dtype.items():
+        tensors = list(tensors.values())
+        numels = [t.numel() for t in tensors]
+        staging = torch.empty(sum(numels), dtype=dtype, pin_memory=True)
+        torch.cat([t.reshape(-1) for t in tensors], out=staging)
+        flat = staging.to(device=device, non_blocking=True)
+        for tensor, chunk in zip(tensors, flat.split(numels)):
+            moved[id(tensor)] = chunk.view(tensor.shape)
+
+    return apply_to_sample(lambda t: moved.get(id(t), t), sample)
+
+
 def move_to_cpu(sample):
     def _move_to_cpu(tensor):
         # PyTorch has poor support for half tensors (float16) on CPU.
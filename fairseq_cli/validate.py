@@ -8,7 +8,8 @@ import logging
 import os
 import sys
 from argparse import Namespace
-from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 
 import torch
 from omegaconf import DictConfig
@@ -26,6 +27,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger("fairseq_cli.validate")
 
+# inference_mode skips autograd bookkeeping entirely (PyTorch >= 1.9)
+inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+_sentinel = object()
+
+
+class CudaPrefetcher(object):
+    """Iterates over *iterable* and moves each sample to the current device on
+    a side stream one step ahead, so that the host-to-device copy of the next
+    batch overlaps with the forward pass of the current one."""
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.stream = torch.cuda.Stream()
+
+    def __len__(self):
+        return len(self.iterable)
+
+    def _preload(self, itr):
+        sample = next(itr, _sentinel)
+        if sample is _sentinel:
+            return sample
+        with torch.cuda.stream(self.stream):
+            return utils.fast_move_to_cuda(sample)
+
+    def __iter__(self):
+        itr = iter(self.iterable)
+        next_sample = self._preload(itr)
+        while next_sample is not _sentinel:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(self.stream)
+            sample = next_sample
+            # the tensors were allocated on the side stream; make sure the
+            # caching allocator does not reuse them while still in use here
+            utils.apply_to_sample(lambda t: t.record_stream(current_stream), sample)
+            next_sample = self._preload(itr)
+            yield sample
+
 
 def main(cfg: DictConfig, override_args=None):
     if isinstance(cfg, Namespace):
@@ -38,6 +76,9 @@ def main(cfg: DictConfig, override_args=None):
     assert (
         cfg.dataset.max_tokens is not None or cfg.dataset.batch_size is not None
     ), "Must specify batch size either with --max-tokens or --batch-size"
+    assert (
+        cfg.dataset.max_valid_steps is None or cfg.dataset.max_valid_steps > 0
+    ), "--max-valid-steps must be at least 1"
 
     use_fp16 = cfg.common.fp16
     use_cuda = torch.cuda.is_available() and not cfg.common.cpu
@@ -82,58 +123,102 @@ def main(cfg: DictConfig, override_args=None):
     criterion = task.build_criterion(saved_cfg.criterion)
     criterion.eval()
 
-    for subset in cfg.dataset.valid_subset.split(","):
+    def load_subset(subset):
         try:
             task.load_dataset(subset, combine=False, epoch=1, task_cfg=saved_cfg.task)
-            dataset = task.dataset(subset)
+            return task.dataset(subset)
         except KeyError:
             raise Exception("Cannot find dataset: " + subset)
 
-        # Initialize data iterator
-        itr = task.get_batch_iterator(
-            dataset=dataset,
-            max_tokens=cfg.dataset.max_tokens,
-            max_sentences=cfg.dataset.batch_size,
-            max_positions=utils.resolve_max_positions(
-                task.max_positions(),
-                *[m.max_positions() for m in models],
-            ),
-            ignore_invalid_inputs=cfg.dataset.skip_invalid_size_inputs_valid_test,
-            required_batch_size_multiple=cfg.dataset.required_batch_size_multiple,
-            seed=cfg.common.seed,
-            num_shards=data_parallel_world_size,
-            shard_id=data_parallel_rank,
-            num_workers=cfg.dataset.num_workers,
-            data_buffer_size=cfg.dataset.data_buffer_size,
-        ).next_epoch_itr(shuffle=False)
-        progress = progress_bar.progress_bar(
-            itr,
-            log_format=cfg.common.log_format,
-            log_interval=cfg.common.log_interval,
-            prefix=f"valid on '{subset}' subset",
-            default_log_format=("tqdm" if not cfg.common.no_progress_bar else "simple"),
-        )
-
-        log_outputs = []
-        for i, sample in enumerate(progress):
-            sample = utils.move_to_cuda(sample) if use_cuda else sample
-            _loss, _sample_size, log_output = task.valid_step(sample, model, criterion)
-            progress.log(log_output, step=i)
-            log_outputs.append(log_output)
-
-        if data_parallel_world_size > 1:
-            log_outputs = distributed_utils.all_gather_list(
-                log_outputs,
-                max_size=cfg.common.all_gather_list_size,
-                group=distributed_utils.get_data_parallel_group(),
+    subsets = cfg.dataset.valid_subset.split(",")
+    prefetcher = None
+    if cfg.dataset.prefetch_valid_subsets and len(subsets) > 1:
+        prefetcher = ThreadPoolExecutor(max_workers=1)
+    next_dataset = None
+
+    try:
+        for subset_idx, subset in enumerate(subsets):
+            if next_dataset is not None:
+                dataset = next_dataset.result()
+            else:
+                dataset = load_subset(subset)
+            if prefetcher is not None and subset_idx + 1 < len(subsets):
+                # overlap loading the next subset with evaluating this one
+                next_dataset = prefetcher.submit(load_subset, subsets[subset_idx + 1])
+
+            # Initialize data iterator
+            itr = task.get_batch_iterator(
+                dataset=dataset,
+                max_tokens=cfg.dataset.max_tokens,
+                max_sentences=cfg.dataset.batch_size,
+                max_positions=utils.resolve_max_positions(
+                    task.max_positions(),
+                    *[m.max_positions() for m in models],
+                ),
+                ignore_invalid_inputs=cfg.dataset.skip_invalid_size_inputs_valid_test,
+                required_batch_size_multiple=cfg.dataset.required_batch_size_multiple,
+                seed=cfg.common.seed,
+                num_shards=data_parallel_world_size,
+                shard_id=data_parallel_rank,
+                num_workers=cfg.dataset.num_workers,
+                data_buffer_size=cfg.dataset.data_buffer_size,
+            ).next_epoch_itr(shuffle=False)
+            progress = progress_bar.progress_bar(
+                itr,
+                log_format=cfg.common.log_format,
+                log_interval=cfg.common.log_interval,
+                prefix=f"valid on '{subset}' subset",
+                default_log_format=(
+                    "tqdm" if not cfg.common.no_progress_bar else "simple"
+                ),
             )
-            log_outputs = list(chain.from_iterable(log_outputs))
-
-        with metrics.aggregate() as agg:
-            task.reduce_metrics(log_outputs, criterion)
-            log_output = agg.get_smoothed_values()
 
-        progress.print(log_output, tag=subset, step=i)
+            log_interval = cfg.common.log_interval or 0
+            # when the criterion's logging outputs can be summed, keep a single
+            # running sum instead of every per-batch output
+            can_sum = task.__class__.logging_outputs_can_be_summed(criterion)
+            batches = progress
+            if cfg.dataset.max_valid_steps is not None:
+                # bound the iterator itself, so that no batch beyond the last one is
+                # collated (or copied to the GPU by the prefetcher)
+                batches = islice(batches, cfg.dataset.max_valid_steps)
+            if use_cuda:
+                batches = CudaPrefetcher(batches)
+            log_outputs = []
+            with inference_mode():
+                for i, sample in enumerate(batches):
+                    _loss, _sample_size, log_output = task.valid_step(
+                        sample, model, criterion
+                    )
+                    # the progress bars only emit every log_interval steps anyway, so
+                    # don't pay for formatting the stats in between
+                    if log_interval > 0 and i % log_interval == 0:
+                        progress.log(log_output, step=i)
+                    if can_sum and len(log_outputs) > 0:
+                        summed = log_outputs[0]
+                        for k, v in log_output.items():
+                            summed[k] = summed.get(k, 0) + v
+                    else:
+                        log_outputs.append(dict(log_output) if can_sum else log_output)
+
+            if data_parallel_world_size > 1:
+                log_outputs = distributed_utils.all_gather_list(
+                    log_outputs,
+                    max_size=cfg.common.all_gather_list_size,
+                    group=distributed_utils.get_data_parallel_group(),
+                )
+                log_outputs = list(chain.from_iterable(log_outputs))
+
+            with metrics.aggregate() as agg:
+                task.reduce_metrics(log_outputs, criterion)
+                log_output = agg.get_smoothed_values()
+
+            progress.print(log_output, tag=subset, step=i)
+    finally:
+        # also runs when evaluating a subset fails, so that a pending load of
+        # the next subset is waited for rather than left running
+        if prefetcher is not None:
+            prefetcher.shutdown()
 
 
 def cli_main():
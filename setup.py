@@ -192,7 +192,7 @@ def do_setup(package_data):
             "packaging",
         ],
         extras_require={
-            "dev": ["flake8", "pytest", "black==22.3.0"],
+            "dev": ["flake8", "pytest", "pytest-xdist", "black==22.3.0"],
             "docs": ["sphinx", "sphinx-argparse"],
         },
         dependency_links=dependency_links,
@@ -0,0 +1,17 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import torch
+
+
+def pytest_configure(config):
+    # The test models are tiny, so extra inter-op threads only oversubscribe the
+    # machine when pytest-xdist runs a worker per core. The setting is global to
+    # the process and torch accepts it only once, before any inter-op work has
+    # started, so it is made here, once per (worker) process, for every test.
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
@@ -0,0 +1,55 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy as np
+
+from fairseq.data import Dictionary, data_utils
+from fairseq.tasks.sentence_ranking import SentenceRankingTask
+
+
+class TestSentenceRankingShuffleCache(unittest.TestCase):
+    def build_task(self, data_dir, seed):
+        args = argparse.Namespace(data=data_dir, seed=seed, cache_shuffle=True)
+        return SentenceRankingTask(args, Dictionary())
+
+    def test_cache_shuffle(self):
+        with TemporaryDirectory() as dirname:
+            task = self.build_task(dirname, seed=1)
+            order = task._shuffle_order("valid", 50)
+
+            with data_utils.numpy_seed(1):
+                expected = np.random.permutation(50)
+            np.testing.assert_array_equal(order, expected)
+            cache_path = os.path.join(dirname, "shuffle.1.valid.50.npy")
+            self.assertTrue(os.path.exists(cache_path))
+
+            # a second load reads the cached order instead of drawing it again
+            with patch("numpy.random.permutation") as permutation:
+                cached = task._shuffle_order("valid", 50)
+            permutation.assert_not_called()
+            np.testing.assert_array_equal(cached, expected)
+
+            # a different number of samples or seed gets its own cache file
+            task._shuffle_order("valid", 40)
+            self.build_task(dirname, seed=2)._shuffle_order("valid", 50)
+            self.assertEqual(
+                sorted(f for f in os.listdir(dirname) if f.startswith("shuffle.")),
+                [
+                    "shuffle.1.valid.40.npy",
+                    "shuffle.1.valid.50.npy",
+                    "shuffle.2.valid.50.npy",
+                ],
+            )
+            self.assertFalse(any(f.endswith(".tmp") for f in os.listdir(dirname)))
+
+
+if __name__ == "__main__":
+    unittest.main()
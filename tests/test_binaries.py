@@ -3,25 +3,38 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import atexit
+import collections
 import contextlib
+import functools
+import importlib.util
 import json
 import logging
 import os
 import random
+import shutil
 import sys
 import tempfile
+import time
 import unittest
 from packaging import version
-from io import StringIO
 from typing import Dict, List
+from unittest.mock import patch
 
+import numpy as np
+import pytest
 import torch
 
 from fairseq import options
-from fairseq_cli import eval_lm, train
+from fairseq.data import data_utils
+from fairseq.logging import progress_bar
+from fairseq.tasks.translation import TranslationTask
+from fairseq_cli import eval_lm, train, validate
 from tests.utils import (
     create_dummy_data,
     create_laser_data_and_config_json,
+    dummy_lines,
+    fresh_parser,
     generate_main,
     preprocess_lm_data,
     preprocess_summarization_data,
@@ -30,229 +43,389 @@ from tests.utils import (
     train_translation_model,
 )
 
-try:
-    import transformers  # noqa
+# only probe for transformers; importing it takes seconds and a single test uses it
+has_hf_transformers = importlib.util.find_spec("transformers") is not None
+
+
+@functools.lru_cache(maxsize=None)
+def _tmp_root():
+    """Directory in which the tests put their data: $FAIRSEQ_TEST_TMPDIR if
+    set, else /dev/shm if it is writable and has at least 1 GiB free, else the
+    default temporary directory (None)."""
+    if os.environ.get("FAIRSEQ_TEST_TMPDIR"):
+        return os.environ["FAIRSEQ_TEST_TMPDIR"]
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        if shutil.disk_usage(shm).free >= 1 << 30:
+            return shm
+    return None
+
+
+def _tempdir(suffix):
+    return tempfile.TemporaryDirectory(suffix, dir=_tmp_root())
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+@functools.lru_cache(maxsize=None)
+def _prebuilt_corpus(kind, extra_flags=(), **data_kwargs):
+    """Directory holding ``create_dummy_data(dir, **data_kwargs)`` binarized for
+    *kind* ("translation" or "lm") with *extra_flags*, or for "roberta_head"
+    the binarized ``create_dummy_roberta_head_data(dir, **data_kwargs)``. It is
+    built once per process and removed at exit."""
+    corpus_dir = tempfile.mkdtemp("test_binaries_corpus", dir=_tmp_root())
+    atexit.register(shutil.rmtree, corpus_dir, ignore_errors=True)
+    # the corpus must not depend on which test happens to build it first
+    torch.manual_seed(0)
+    random.seed(0)
+    if kind == "roberta_head":
+        assert not extra_flags, extra_flags
+        create_dummy_roberta_head_data(corpus_dir, **data_kwargs)
+        preprocess_lm_data(os.path.join(corpus_dir, "input0"))
+        if not data_kwargs.get("regression", False):
+            preprocess_lm_data(os.path.join(corpus_dir, "label"))
+        return corpus_dir
+    create_dummy_data(corpus_dir, **data_kwargs)
+    if kind == "translation":
+        preprocess_translation_data(corpus_dir, list(extra_flags))
+    else:
+        assert kind == "lm" and not extra_flags, (kind, extra_flags)
+        preprocess_lm_data(corpus_dir)
+    return corpus_dir
+
+
+def _prepare_corpus(data_dir, kind, extra_flags=None, **data_kwargs):
+    """Hardlink the cached ``_prebuilt_corpus`` into *data_dir*. Tests may add
+    files to *data_dir*, but must not modify the linked ones."""
+    shutil.copytree(
+        _prebuilt_corpus(kind, tuple(extra_flags or []), **data_kwargs),
+        data_dir,
+        copy_function=_link_or_copy,
+        dirs_exist_ok=True,
+    )
+
+
+class BinaryTestCase(unittest.TestCase):
+    """Base class for the end-to-end tests below.
+
+    The dummy corpora are identical for most tests, so they are created and
+    binarized once per process and hardlinked into each test's directory.
+    Tests may add files to that directory, but must not modify the linked ones.
 
-    has_hf_transformers = True
-except ImportError:
-    has_hf_transformers = False
+    The models are tiny, so unless a class sets ``requires_cuda`` they run on
+    the CPU with a single intra-op thread: that avoids the CUDA context setup
+    and keeps parallel test workers from oversubscribing the machine. The
+    inter-op thread count is process-global, so tests/conftest.py sets it to one
+    for the whole test session.
+    """
 
+    requires_cuda = False
+
+    @classmethod
+    def setUpClass(cls):
+        cls._models_dir = _tempdir("test_binaries_models")
+        cls._models = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._models_dir.cleanup()
 
-class TestTranslation(unittest.TestCase):
     def setUp(self):
         logging.disable(logging.CRITICAL)
+        # training and generation print to stdout; send that to /dev/null
+        # rather than accumulating it in memory
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        devnull = stack.enter_context(open(os.devnull, "w"))
+        stack.enter_context(contextlib.redirect_stdout(devnull))
+        if not self.requires_cuda:
+            patcher = patch("torch.cuda.is_available", return_value=False)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            self.addCleanup(torch.set_num_threads, torch.get_num_threads())
+            torch.set_num_threads(1)
 
     def tearDown(self):
         logging.disable(logging.NOTSET)
-
+        # don't let a process group from a distributed test leak into the next
+        # test run by the same worker
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            torch.distributed.destroy_process_group()
+
+    def prepare_translation_data(self, data_dir, extra_flags=None, **data_kwargs):
+        """Same as ``create_dummy_data(data_dir, **data_kwargs)`` followed by
+        ``preprocess_translation_data(data_dir, extra_flags)``, but reuses the
+        binarized corpus of earlier tests with the same arguments."""
+        _prepare_corpus(data_dir, "translation", extra_flags, **data_kwargs)
+
+    def prepare_lm_data(self, data_dir):
+        """Same as ``create_dummy_data(data_dir)`` followed by
+        ``preprocess_lm_data(data_dir)``, reusing the corpus of earlier tests."""
+        _prepare_corpus(data_dir, "lm")
+
+    def prepare_roberta_head_data(self, data_dir, num_classes, regression=False):
+        """Same as ``create_dummy_roberta_head_data`` followed by binarizing the
+        inputs (and the labels, unless *regression*), reusing the corpus of
+        earlier tests with the same arguments."""
+        _prepare_corpus(
+            data_dir, "roberta_head", num_classes=num_classes, regression=regression
+        )
+
+    def prepare_trained_translation_model(self, data_dir, arch, extra_flags=None):
+        """Prepare the default translation corpus in *data_dir* together with
+        the ``checkpoint_last.pt`` of ``train_translation_model(data_dir, arch,
+        extra_flags)``. Tests that only vary generation flags share a model
+        this way, so it is trained once per class."""
+        key = (arch, tuple(extra_flags or []))
+        if key not in self._models:
+            name = f"model{len(self._models)}"
+            model_dir = os.path.join(self._models_dir.name, name)
+            self.prepare_translation_data(model_dir)
+            train_translation_model(model_dir, arch, list(key[1]))
+            self._models[key] = os.path.join(model_dir, "checkpoint_last.pt")
+        self.prepare_translation_data(data_dir)
+        _link_or_copy(self._models[key], os.path.join(data_dir, "checkpoint_last.pt"))
+
+
+class TestTranslation(BinaryTestCase):
     def test_fconv(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_fconv") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(data_dir, "fconv_iwslt_de_en")
-                generate_main(data_dir)
+        with _tempdir("test_fconv") as data_dir:
+            self.prepare_trained_translation_model(data_dir, "fconv_iwslt_de_en")
+            generate_main(data_dir)
 
     def test_raw(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_fconv_raw") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir, ["--dataset-impl", "raw"])
-                train_translation_model(
-                    data_dir, "fconv_iwslt_de_en", ["--dataset-impl", "raw"]
-                )
-                generate_main(data_dir, ["--dataset-impl", "raw"])
+        with _tempdir("test_fconv_raw") as data_dir:
+            self.prepare_translation_data(data_dir, ["--dataset-impl", "raw"])
+            train_translation_model(
+                data_dir, "fconv_iwslt_de_en", ["--dataset-impl", "raw"]
+            )
+            generate_main(data_dir, ["--dataset-impl", "raw"])
 
     def test_update_freq(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_update_freq") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir, "fconv_iwslt_de_en", ["--update-freq", "3"]
-                )
-                generate_main(data_dir)
+        with _tempdir("test_update_freq") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir, "fconv_iwslt_de_en", ["--update-freq", "3"]
+            )
+            generate_main(data_dir)
 
     def test_max_positions(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_max_positions") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                with self.assertRaises(Exception) as context:
-                    train_translation_model(
-                        data_dir,
-                        "fconv_iwslt_de_en",
-                        ["--max-target-positions", "5"],
-                    )
-                self.assertTrue(
-                    "skip this example with --skip-invalid-size-inputs-valid-test"
-                    in str(context.exception)
-                )
+        with _tempdir("test_max_positions") as data_dir:
+            self.prepare_translation_data(data_dir)
+            with self.assertRaises(Exception) as context:
                 train_translation_model(
                     data_dir,
                     "fconv_iwslt_de_en",
-                    [
-                        "--max-target-positions",
-                        "5",
-                        "--skip-invalid-size-inputs-valid-test",
-                    ],
+                    ["--max-target-positions", "5"],
                 )
-                with self.assertRaises(Exception) as context:
-                    generate_main(data_dir)
-                generate_main(data_dir, ["--skip-invalid-size-inputs-valid-test"])
+            self.assertTrue(
+                "skip this example with --skip-invalid-size-inputs-valid-test"
+                in str(context.exception)
+            )
+            train_translation_model(
+                data_dir,
+                "fconv_iwslt_de_en",
+                [
+                    "--max-target-positions",
+                    "5",
+                    "--skip-invalid-size-inputs-valid-test",
+                ],
+            )
+            with self.assertRaises(Exception) as context:
+                generate_main(data_dir)
+            generate_main(data_dir, ["--skip-invalid-size-inputs-valid-test"])
 
     def test_generation(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_sampling") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(data_dir, "fconv_iwslt_de_en")
+        with _tempdir("test_generation") as data_dir:
+            self.prepare_trained_translation_model(data_dir, "fconv_iwslt_de_en")
+            with self.assertRaises(ValueError):
                 generate_main(
                     data_dir,
                     [
-                        "--sampling",
-                        "--temperature",
-                        "2",
-                        "--beam",
-                        "2",
-                        "--nbest",
-                        "2",
+                        "--diverse-beam-groups",
+                        "4",
+                        "--match-source-len",
                     ],
                 )
-                generate_main(
-                    data_dir,
-                    [
-                        "--sampling",
-                        "--sampling-topk",
-                        "3",
-                        "--beam",
-                        "2",
-                        "--nbest",
-                        "2",
-                    ],
-                )
-                generate_main(
-                    data_dir,
-                    [
-                        "--sampling",
-                        "--sampling-topp",
-                        "0.2",
-                        "--beam",
-                        "2",
-                        "--nbest",
-                        "2",
-                    ],
-                )
-                generate_main(
-                    data_dir,
-                    [
-                        "--diversity-rate",
-                        "0.5",
-                        "--beam",
-                        "6",
-                    ],
-                )
-                with self.assertRaises(ValueError):
-                    generate_main(
-                        data_dir,
-                        [
-                            "--diverse-beam-groups",
-                            "4",
-                            "--match-source-len",
-                        ],
-                    )
-                generate_main(data_dir, ["--prefix-size", "2"])
-                generate_main(data_dir, ["--retain-dropout"])
+            generate_main(data_dir, ["--prefix-size", "2"])
+
+    @pytest.mark.slow
+    def test_generation_sampling_variants(self):
+        with _tempdir("test_sampling") as data_dir:
+            self.prepare_trained_translation_model(data_dir, "fconv_iwslt_de_en")
+            generate_main(
+                data_dir,
+                [
+                    "--sampling",
+                    "--temperature",
+                    "2",
+                    "--beam",
+                    "2",
+                    "--nbest",
+                    "2",
+                ],
+            )
+            generate_main(
+                data_dir,
+                [
+                    "--sampling",
+                    "--sampling-topk",
+                    "3",
+                    "--beam",
+                    "2",
+                    "--nbest",
+                    "2",
+                ],
+            )
+            generate_main(
+                data_dir,
+                [
+                    "--sampling",
+                    "--sampling-topp",
+                    "0.2",
+                    "--beam",
+                    "2",
+                    "--nbest",
+                    "2",
+                ],
+            )
+            generate_main(
+                data_dir,
+                [
+                    "--diversity-rate",
+                    "0.5",
+                    "--beam",
+                    "6",
+                ],
+            )
+            generate_main(data_dir, ["--retain-dropout"])
+
+    def test_prefetch_valid_subsets(self):
+        with _tempdir("test_prefetch_valid_subsets") as data_dir:
+            self.prepare_trained_translation_model(data_dir, "fconv_iwslt_de_en")
+            load_dataset = TranslationTask.load_dataset
+
+            def seeded_load_dataset(task, split, **kwargs):
+                load_dataset(task, split, **kwargs)
+                # draw from the global NumPy PRNG in small steps, so that the
+                # evaluation of the previous subset has a chance to interleave
+                with data_utils.numpy_seed(1):
+                    for _ in range(20):
+                        draws[split].append(np.random.rand())
+                        time.sleep(0.001)
+
+            stats = []
+            for flags in [[], ["--prefetch-valid-subsets"]]:
+                draws = collections.defaultdict(list)
+                # validate reports the stats of each subset through print()
+                with patch.object(
+                    TranslationTask, "load_dataset", seeded_load_dataset
+                ), patch.object(
+                    progress_bar.SimpleProgressBar, "print", autospec=True
+                ) as print_stats:
+                    validate_main(data_dir, ["--valid-subset", "valid,test"] + flags)
+                stats.append(
+                    {c.kwargs["tag"]: c.args[1] for c in print_stats.call_args_list}
+                )
+                with data_utils.numpy_seed(1):
+                    expected = [np.random.rand() for _ in range(20)]
+                self.assertEqual(draws, {"valid": expected, "test": expected})
+            self.assertEqual(list(stats[0]), ["valid", "test"])
+            self.assertEqual(stats[0], stats[1])
+
+    def test_validate_max_valid_steps(self):
+        with _tempdir("test_validate_max_valid_steps") as data_dir:
+            # rejected before anything is loaded, as no batch would be evaluated
+            with self.assertRaisesRegex(AssertionError, "--max-valid-steps"):
+                validate_main(data_dir, ["--max-valid-steps", "0"])
 
     def test_eval_bleu(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_eval_bleu") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "fconv_iwslt_de_en",
-                    [
-                        "--eval-bleu",
-                        "--eval-bleu-print-samples",
-                        "--eval-bleu-remove-bpe",
-                        "--eval-bleu-detok",
-                        "space",
-                        "--eval-bleu-args",
-                        '{"beam": 4, "min_len": 10}',
-                    ],
-                )
+        with _tempdir("test_eval_bleu") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                "fconv_iwslt_de_en",
+                [
+                    "--eval-bleu",
+                    "--eval-bleu-print-samples",
+                    "--eval-bleu-remove-bpe",
+                    "--eval-bleu-detok",
+                    "space",
+                    "--eval-bleu-args",
+                    '{"beam": 4, "min_len": 10}',
+                ],
+                save_checkpoint=False,
+            )
 
     def test_lstm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_lstm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "lstm_wiseman_iwslt_de_en",
-                    [
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--decoder-out-embed-dim",
-                        "8",
-                    ],
-                )
-                generate_main(data_dir)
+        with _tempdir("test_lstm") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                "lstm_wiseman_iwslt_de_en",
+                [
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--decoder-out-embed-dim",
+                    "8",
+                ],
+            )
+            generate_main(data_dir)
 
     def test_lstm_bidirectional(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_lstm_bidirectional") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "lstm",
-                    [
-                        "--encoder-layers",
-                        "2",
-                        "--encoder-bidirectional",
-                        "--encoder-hidden-size",
-                        "16",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--decoder-out-embed-dim",
-                        "8",
-                        "--decoder-layers",
-                        "2",
-                    ],
-                )
-                generate_main(data_dir)
+        with _tempdir("test_lstm_bidirectional") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                "lstm",
+                [
+                    "--encoder-layers",
+                    "2",
+                    "--encoder-bidirectional",
+                    "--encoder-hidden-size",
+                    "16",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--decoder-out-embed-dim",
+                    "8",
+                    "--decoder-layers",
+                    "2",
+                ],
+            )
+            generate_main(data_dir)
 
     def test_transformer(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_transformer") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "transformer_iwslt_de_en",
-                    [
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                    ],
-                    run_validation=True,
-                )
-                generate_main(data_dir)
+        with _tempdir("test_transformer") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                "transformer_iwslt_de_en",
+                [
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                ],
+                run_validation=True,
+            )
+            generate_main(data_dir)
 
     def test_multilingual_transformer(self):
         # test with all combinations of encoder/decoder lang tokens
@@ -262,16 +435,15 @@ class TestTranslation(unittest.TestCase):
             ["--encoder-langtok", "tgt"],
         ]
         decoder_langtok_flags = [[], ["--decoder-langtok"]]
-        with contextlib.redirect_stdout(StringIO()):
-            for i in range(len(encoder_langtok_flags)):
-                for j in range(len(decoder_langtok_flags)):
-                    enc_ltok_flag = encoder_langtok_flags[i]
-                    dec_ltok_flag = decoder_langtok_flags[j]
-                    with tempfile.TemporaryDirectory(
-                        f"test_multilingual_transformer_{i}_{j}"
-                    ) as data_dir:
-                        create_dummy_data(data_dir)
-                        preprocess_translation_data(data_dir)
+        for i in range(len(encoder_langtok_flags)):
+            for j in range(len(decoder_langtok_flags)):
+                enc_ltok_flag = encoder_langtok_flags[i]
+                dec_ltok_flag = decoder_langtok_flags[j]
+                with self.subTest(
+                    enc_ltok_flag=enc_ltok_flag, dec_ltok_flag=dec_ltok_flag
+                ):
+                    with _tempdir(f"test_multilingual_transformer_{i}_{j}") as data_dir:
+                        self.prepare_translation_data(data_dir)
                         train_translation_model(
                             data_dir,
                             arch="multilingual_transformer",
@@ -315,20 +487,17 @@ class TestTranslation(unittest.TestCase):
         # test with latent depth in encoder, decoder, or both
         encoder_latent_layer = [[], ["--encoder-latent-layer"]]
         decoder_latent_layer = [[], ["--decoder-latent-layer"]]
-        with contextlib.redirect_stdout(StringIO()):
-            for i in range(len(encoder_latent_layer)):
-                for j in range(len(decoder_latent_layer)):
-                    if i == 0 and j == 0:
-                        continue
-                    enc_ll_flag = encoder_latent_layer[i]
-                    dec_ll_flag = decoder_latent_layer[j]
-                    with tempfile.TemporaryDirectory(
+        for i in range(len(encoder_latent_layer)):
+            for j in range(len(decoder_latent_layer)):
+                if i == 0 and j == 0:
+                    continue
+                enc_ll_flag = encoder_latent_layer[i]
+                dec_ll_flag = decoder_latent_layer[j]
+                with self.subTest(enc_ll_flag=enc_ll_flag, dec_ll_flag=dec_ll_flag):
+                    with _tempdir(
                         f"test_multilingual_translation_latent_depth_{i}_{j}"
                     ) as data_dir:
-                        create_dummy_data(data_dir)
-                        preprocess_translation_data(
-                            data_dir, extra_flags=["--joined-dictionary"]
-                        )
+                        self.prepare_translation_data(data_dir, ["--joined-dictionary"])
                         train_translation_model(
                             data_dir,
                             arch="latent_multilingual_transformer",
@@ -386,18 +555,17 @@ class TestTranslation(unittest.TestCase):
             ["--encoder-langtok", "tgt"],
         ]
         decoder_langtok_flags = [[], ["--decoder-langtok"]]
-        with contextlib.redirect_stdout(StringIO()):
-            for i in range(len(encoder_langtok_flags)):
-                for j in range(len(decoder_langtok_flags)):
-                    enc_ltok_flag = encoder_langtok_flags[i]
-                    dec_ltok_flag = decoder_langtok_flags[j]
-                    with tempfile.TemporaryDirectory(
+        for i in range(len(encoder_langtok_flags)):
+            for j in range(len(decoder_langtok_flags)):
+                enc_ltok_flag = encoder_langtok_flags[i]
+                dec_ltok_flag = decoder_langtok_flags[j]
+                with self.subTest(
+                    enc_ltok_flag=enc_ltok_flag, dec_ltok_flag=dec_ltok_flag
+                ):
+                    with _tempdir(
                         f"test_translation_multi_simple_epoch_{i}_{j}"
                     ) as data_dir:
-                        create_dummy_data(data_dir)
-                        preprocess_translation_data(
-                            data_dir, extra_flags=["--joined-dictionary"]
-                        )
+                        self.prepare_translation_data(data_dir, ["--joined-dictionary"])
                         train_translation_model(
                             data_dir,
                             arch="transformer",
@@ -442,346 +610,303 @@ class TestTranslation(unittest.TestCase):
 
     def test_translation_multi_simple_epoch_no_vepoch(self):
         # test with all combinations of encoder/decoder lang tokens
-        with contextlib.redirect_stdout(StringIO()):
-            enc_ltok_flag = ["--encoder-langtok", "src"]
-            dec_ltok_flag = ["--decoder-langtok"]
-            with tempfile.TemporaryDirectory(
-                "test_translation_multi_simple_epoch_dict"
-            ) as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir, extra_flags=[])
-                train_translation_model(
-                    data_dir,
-                    arch="transformer",
-                    task="translation_multi_simple_epoch",
-                    extra_flags=[
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--sampling-method",
-                        "temperature",
-                        "--sampling-temperature",
-                        "1.5",
-                    ]
-                    + enc_ltok_flag
-                    + dec_ltok_flag,
-                    lang_flags=["--lang-pairs", "in-out"],
-                    run_validation=True,
-                    extra_valid_flags=enc_ltok_flag + dec_ltok_flag,
-                )
-                generate_main(
-                    data_dir,
-                    extra_flags=[
-                        "--task",
-                        "translation_multi_simple_epoch",
-                        "--lang-pairs",
-                        "in-out",
-                        "--source-lang",
-                        "in",
-                        "--target-lang",
-                        "out",
-                    ]
-                    + enc_ltok_flag
-                    + dec_ltok_flag,
-                )
+        enc_ltok_flag = ["--encoder-langtok", "src"]
+        dec_ltok_flag = ["--decoder-langtok"]
+        with _tempdir("test_translation_multi_simple_epoch_dict") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                arch="transformer",
+                task="translation_multi_simple_epoch",
+                extra_flags=[
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--sampling-method",
+                    "temperature",
+                    "--sampling-temperature",
+                    "1.5",
+                ]
+                + enc_ltok_flag
+                + dec_ltok_flag,
+                lang_flags=["--lang-pairs", "in-out"],
+                run_validation=True,
+                extra_valid_flags=enc_ltok_flag + dec_ltok_flag,
+            )
+            generate_main(
+                data_dir,
+                extra_flags=[
+                    "--task",
+                    "translation_multi_simple_epoch",
+                    "--lang-pairs",
+                    "in-out",
+                    "--source-lang",
+                    "in",
+                    "--target-lang",
+                    "out",
+                ]
+                + enc_ltok_flag
+                + dec_ltok_flag,
+            )
 
     def test_translation_multi_simple_epoch_dicts(self):
         # test with all combinations of encoder/decoder lang tokens
-        with contextlib.redirect_stdout(StringIO()):
-            enc_ltok_flag = ["--encoder-langtok", "src"]
-            dec_ltok_flag = ["--decoder-langtok"]
-            with tempfile.TemporaryDirectory(
-                "test_translation_multi_simple_epoch_dict"
-            ) as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir, extra_flags=[])
-                train_translation_model(
-                    data_dir,
-                    arch="transformer",
-                    task="translation_multi_simple_epoch",
-                    extra_flags=[
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--sampling-method",
-                        "temperature",
-                        "--sampling-temperature",
-                        "1.5",
-                        "--virtual-epoch-size",
-                        "1000",
-                    ]
-                    + enc_ltok_flag
-                    + dec_ltok_flag,
-                    lang_flags=["--lang-pairs", "in-out"],
-                    run_validation=True,
-                    extra_valid_flags=enc_ltok_flag + dec_ltok_flag,
-                )
-                generate_main(
-                    data_dir,
-                    extra_flags=[
-                        "--task",
-                        "translation_multi_simple_epoch",
-                        "--lang-pairs",
-                        "in-out",
-                        "--source-lang",
-                        "in",
-                        "--target-lang",
-                        "out",
-                    ]
-                    + enc_ltok_flag
-                    + dec_ltok_flag,
-                )
+        enc_ltok_flag = ["--encoder-langtok", "src"]
+        dec_ltok_flag = ["--decoder-langtok"]
+        with _tempdir("test_translation_multi_simple_epoch_dict") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                arch="transformer",
+                task="translation_multi_simple_epoch",
+                extra_flags=[
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--sampling-method",
+                    "temperature",
+                    "--sampling-temperature",
+                    "1.5",
+                    "--virtual-epoch-size",
+                    "1000",
+                ]
+                + enc_ltok_flag
+                + dec_ltok_flag,
+                lang_flags=["--lang-pairs", "in-out"],
+                run_validation=True,
+                extra_valid_flags=enc_ltok_flag + dec_ltok_flag,
+            )
+            generate_main(
+                data_dir,
+                extra_flags=[
+                    "--task",
+                    "translation_multi_simple_epoch",
+                    "--lang-pairs",
+                    "in-out",
+                    "--source-lang",
+                    "in",
+                    "--target-lang",
+                    "out",
+                ]
+                + enc_ltok_flag
+                + dec_ltok_flag,
+            )
 
     def test_translation_multi_simple_epoch_src_tgt_dict_spec(self):
         # test the specification of explicit --src-dict and --tgt-dict
-        with contextlib.redirect_stdout(StringIO()):
-            enc_ltok_flag = ["--encoder-langtok", "src"]
-            dec_ltok_flag = ["--decoder-langtok"]
-            with tempfile.TemporaryDirectory(
-                "test_translation_multi_simple_epoch_dict"
-            ) as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir, extra_flags=[])
-                train_translation_model(
-                    data_dir,
-                    arch="transformer",
-                    task="translation_multi_simple_epoch",
-                    extra_flags=[
-                        "--source-dict",
-                        f"{data_dir}/dict.in.txt",
-                        "--target-dict",
-                        f"{data_dir}/dict.out.txt",
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--sampling-method",
-                        "temperature",
-                        "--sampling-temperature",
-                        "1.5",
-                        "--virtual-epoch-size",
-                        "1000",
-                    ]
-                    + enc_ltok_flag
-                    + dec_ltok_flag,
-                    lang_flags=["--lang-pairs", "in-out"],
-                    run_validation=True,
-                    extra_valid_flags=enc_ltok_flag + dec_ltok_flag,
-                )
-                generate_main(
-                    data_dir,
-                    extra_flags=[
-                        "--task",
-                        "translation_multi_simple_epoch",
-                        "--lang-pairs",
-                        "in-out",
-                        "--source-lang",
-                        "in",
-                        "--target-lang",
-                        "out",
-                    ]
-                    + enc_ltok_flag
-                    + dec_ltok_flag,
-                )
+        enc_ltok_flag = ["--encoder-langtok", "src"]
+        dec_ltok_flag = ["--decoder-langtok"]
+        with _tempdir("test_translation_multi_simple_epoch_dict") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                arch="transformer",
+                task="translation_multi_simple_epoch",
+                extra_flags=[
+                    "--source-dict",
+                    f"{data_dir}/dict.in.txt",
+                    "--target-dict",
+                    f"{data_dir}/dict.out.txt",
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--sampling-method",
+                    "temperature",
+                    "--sampling-temperature",
+                    "1.5",
+                    "--virtual-epoch-size",
+                    "1000",
+                ]
+                + enc_ltok_flag
+                + dec_ltok_flag,
+                lang_flags=["--lang-pairs", "in-out"],
+                run_validation=True,
+                extra_valid_flags=enc_ltok_flag + dec_ltok_flag,
+            )
+            generate_main(
+                data_dir,
+                extra_flags=[
+                    "--task",
+                    "translation_multi_simple_epoch",
+                    "--lang-pairs",
+                    "in-out",
+                    "--source-lang",
+                    "in",
+                    "--target-lang",
+                    "out",
+                ]
+                + enc_ltok_flag
+                + dec_ltok_flag,
+            )
 
     def test_transformer_cross_self_attention(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_transformer_cross_self_attention"
-            ) as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "transformer_iwslt_de_en",
-                    [
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--no-cross-attention",
-                        "--cross-self-attention",
-                    ],
-                    run_validation=True,
-                )
-                generate_main(data_dir, extra_flags=[])
+        with _tempdir("test_transformer_cross_self_attention") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                "transformer_iwslt_de_en",
+                [
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--no-cross-attention",
+                    "--cross-self-attention",
+                ],
+                run_validation=True,
+            )
+            generate_main(data_dir, extra_flags=[])
 
     @unittest.skipIf(
         version.parse(torch.__version__) > version.parse("1.8"),
         "skip for latest torch versions",
     )
     def test_transformer_pointer_generator(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_transformer_pointer_generator"
-            ) as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_summarization_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "transformer_pointer_generator",
-                    extra_flags=[
-                        "--user-dir",
-                        "examples/pointer_generator/pointer_generator_src",
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--alignment-layer",
-                        "-1",
-                        "--alignment-heads",
-                        "1",
-                        "--source-position-markers",
-                        "0",
-                    ],
-                    run_validation=True,
-                    extra_valid_flags=[
-                        "--user-dir",
-                        "examples/pointer_generator/pointer_generator_src",
-                    ],
-                )
-                generate_main(
-                    data_dir,
-                    extra_flags=[
-                        "--user-dir",
-                        "examples/pointer_generator/pointer_generator_src",
-                    ],
-                )
+        with _tempdir("test_transformer_pointer_generator") as data_dir:
+            # unlike the cached corpora, this data is drawn here: seed it so it
+            # doesn't depend on which tests ran before on this worker
+            torch.manual_seed(0)
+            create_dummy_data(data_dir)
+            preprocess_summarization_data(data_dir)
+            train_translation_model(
+                data_dir,
+                "transformer_pointer_generator",
+                extra_flags=[
+                    "--user-dir",
+                    "examples/pointer_generator/pointer_generator_src",
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--alignment-layer",
+                    "-1",
+                    "--alignment-heads",
+                    "1",
+                    "--source-position-markers",
+                    "0",
+                ],
+                run_validation=True,
+                extra_valid_flags=[
+                    "--user-dir",
+                    "examples/pointer_generator/pointer_generator_src",
+                ],
+            )
+            generate_main(
+                data_dir,
+                extra_flags=[
+                    "--user-dir",
+                    "examples/pointer_generator/pointer_generator_src",
+                ],
+            )
 
     def test_lightconv(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_lightconv") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "lightconv_iwslt_de_en",
-                    [
-                        "--encoder-conv-type",
-                        "lightweight",
-                        "--decoder-conv-type",
-                        "lightweight",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                    ],
-                )
-                generate_main(data_dir)
-
-    def test_dynamicconv(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_dynamicconv") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "lightconv_iwslt_de_en",
-                    [
-                        "--encoder-conv-type",
-                        "dynamic",
-                        "--decoder-conv-type",
-                        "dynamic",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                    ],
-                )
-                generate_main(data_dir)
+        for conv_type in ["lightweight", "dynamic"]:
+            with self.subTest(conv_type=conv_type):
+                with _tempdir(f"test_lightconv_{conv_type}") as data_dir:
+                    self.prepare_translation_data(data_dir)
+                    train_translation_model(
+                        data_dir,
+                        "lightconv_iwslt_de_en",
+                        [
+                            "--encoder-conv-type",
+                            conv_type,
+                            "--decoder-conv-type",
+                            conv_type,
+                            "--encoder-embed-dim",
+                            "8",
+                            "--decoder-embed-dim",
+                            "8",
+                        ],
+                    )
+                    generate_main(data_dir)
 
     def test_cmlm_transformer(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_cmlm_transformer") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir, ["--joined-dictionary"])
-                train_translation_model(
-                    data_dir,
-                    "cmlm_transformer",
-                    [
-                        "--apply-bert-init",
-                        "--criterion",
-                        "nat_loss",
-                        "--noise",
-                        "full_mask",
-                        "--pred-length-offset",
-                        "--length-loss-factor",
-                        "0.1",
-                    ],
-                    task="translation_lev",
-                )
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "translation_lev",
-                        "--iter-decode-max-iter",
-                        "9",
-                        "--iter-decode-eos-penalty",
-                        "0",
-                        "--print-step",
-                    ],
-                )
+        with _tempdir("test_cmlm_transformer") as data_dir:
+            self.prepare_translation_data(data_dir, ["--joined-dictionary"])
+            train_translation_model(
+                data_dir,
+                "cmlm_transformer",
+                [
+                    "--apply-bert-init",
+                    "--criterion",
+                    "nat_loss",
+                    "--noise",
+                    "full_mask",
+                    "--pred-length-offset",
+                    "--length-loss-factor",
+                    "0.1",
+                ],
+                task="translation_lev",
+            )
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "translation_lev",
+                    "--iter-decode-max-iter",
+                    "9",
+                    "--iter-decode-eos-penalty",
+                    "0",
+                    "--print-step",
+                ],
+            )
 
     def test_nonautoregressive_transformer(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_nonautoregressive_transformer"
-            ) as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir, ["--joined-dictionary"])
-                train_translation_model(
-                    data_dir,
-                    "nonautoregressive_transformer",
-                    [
-                        "--apply-bert-init",
-                        "--src-embedding-copy",
-                        "--criterion",
-                        "nat_loss",
-                        "--noise",
-                        "full_mask",
-                        "--pred-length-offset",
-                        "--length-loss-factor",
-                        "0.1",
-                    ],
-                    task="translation_lev",
-                )
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "translation_lev",
-                        "--iter-decode-max-iter",
-                        "0",
-                        "--iter-decode-eos-penalty",
-                        "0",
-                        "--print-step",
-                    ],
-                )
+        with _tempdir("test_nonautoregressive_transformer") as data_dir:
+            self.prepare_translation_data(data_dir, ["--joined-dictionary"])
+            train_translation_model(
+                data_dir,
+                "nonautoregressive_transformer",
+                [
+                    "--apply-bert-init",
+                    "--src-embedding-copy",
+                    "--criterion",
+                    "nat_loss",
+                    "--noise",
+                    "full_mask",
+                    "--pred-length-offset",
+                    "--length-loss-factor",
+                    "0.1",
+                ],
+                task="translation_lev",
+            )
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "translation_lev",
+                    "--iter-decode-max-iter",
+                    "0",
+                    "--iter-decode-eos-penalty",
+                    "0",
+                    "--print-step",
+                ],
+            )
 
     # def test_nat_crf_transformer(self):
     #     with contextlib.redirect_stdout(StringIO()):
@@ -803,762 +928,702 @@ class TestTranslation(unittest.TestCase):
     #                 '--print-step',
     #             ])
 
+    @pytest.mark.slow
     def test_iterative_nonautoregressive_transformer(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_iterative_nonautoregressive_transformer"
-            ) as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir, ["--joined-dictionary"])
-                train_translation_model(
-                    data_dir,
-                    "iterative_nonautoregressive_transformer",
-                    [
-                        "--apply-bert-init",
-                        "--src-embedding-copy",
-                        "--criterion",
-                        "nat_loss",
-                        "--noise",
-                        "full_mask",
-                        "--stochastic-approx",
-                        "--dae-ratio",
-                        "0.5",
-                        "--train-step",
-                        "3",
-                    ],
-                    task="translation_lev",
-                )
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "translation_lev",
-                        "--iter-decode-max-iter",
-                        "9",
-                        "--iter-decode-eos-penalty",
-                        "0",
-                        "--print-step",
-                    ],
-                )
+        with _tempdir("test_iterative_nonautoregressive_transformer") as data_dir:
+            self.prepare_translation_data(data_dir, ["--joined-dictionary"])
+            train_translation_model(
+                data_dir,
+                "iterative_nonautoregressive_transformer",
+                [
+                    "--apply-bert-init",
+                    "--src-embedding-copy",
+                    "--criterion",
+                    "nat_loss",
+                    "--noise",
+                    "full_mask",
+                    "--stochastic-approx",
+                    "--dae-ratio",
+                    "0.5",
+                    "--train-step",
+                    "3",
+                ],
+                task="translation_lev",
+            )
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "translation_lev",
+                    "--iter-decode-max-iter",
+                    "9",
+                    "--iter-decode-eos-penalty",
+                    "0",
+                    "--print-step",
+                ],
+            )
 
     def test_insertion_transformer(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_insertion_transformer") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir, ["--joined-dictionary"])
-                train_translation_model(
-                    data_dir,
-                    "insertion_transformer",
-                    [
-                        "--apply-bert-init",
-                        "--criterion",
-                        "nat_loss",
-                        "--noise",
-                        "random_mask",
-                    ],
-                    task="translation_lev",
-                )
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "translation_lev",
-                        "--iter-decode-max-iter",
-                        "9",
-                        "--iter-decode-eos-penalty",
-                        "0",
-                        "--print-step",
-                    ],
-                )
+        with _tempdir("test_insertion_transformer") as data_dir:
+            self.prepare_translation_data(data_dir, ["--joined-dictionary"])
+            train_translation_model(
+                data_dir,
+                "insertion_transformer",
+                [
+                    "--apply-bert-init",
+                    "--criterion",
+                    "nat_loss",
+                    "--noise",
+                    "random_mask",
+                ],
+                task="translation_lev",
+            )
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "translation_lev",
+                    "--iter-decode-max-iter",
+                    "9",
+                    "--iter-decode-eos-penalty",
+                    "0",
+                    "--print-step",
+                ],
+            )
 
+    @pytest.mark.slow
     def test_mixture_of_experts(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_moe") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "transformer_iwslt_de_en",
-                    [
-                        "--task",
-                        "translation_moe",
-                        "--user-dir",
-                        "examples/translation_moe/translation_moe_src",
-                        "--method",
-                        "hMoElp",
-                        "--mean-pool-gating-network",
-                        "--num-experts",
-                        "3",
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                    ],
-                )
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "translation_moe",
-                        "--user-dir",
-                        "examples/translation_moe/translation_moe_src",
-                        "--method",
-                        "hMoElp",
-                        "--mean-pool-gating-network",
-                        "--num-experts",
-                        "3",
-                        "--gen-expert",
-                        "0",
-                    ],
-                )
+        with _tempdir("test_moe") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                "transformer_iwslt_de_en",
+                [
+                    "--task",
+                    "translation_moe",
+                    "--user-dir",
+                    "examples/translation_moe/translation_moe_src",
+                    "--method",
+                    "hMoElp",
+                    "--mean-pool-gating-network",
+                    "--num-experts",
+                    "3",
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                ],
+            )
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "translation_moe",
+                    "--user-dir",
+                    "examples/translation_moe/translation_moe_src",
+                    "--method",
+                    "hMoElp",
+                    "--mean-pool-gating-network",
+                    "--num-experts",
+                    "3",
+                    "--gen-expert",
+                    "0",
+                ],
+            )
 
     def test_alignment(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_alignment") as data_dir:
-                create_dummy_data(data_dir, alignment=True)
-                preprocess_translation_data(data_dir, ["--align-suffix", "align"])
-                train_translation_model(
-                    data_dir,
-                    "transformer_align",
-                    [
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--load-alignments",
-                        "--alignment-layer",
-                        "1",
-                        "--criterion",
-                        "label_smoothed_cross_entropy_with_alignment",
-                    ],
-                    run_validation=True,
-                )
-                generate_main(data_dir)
+        with _tempdir("test_alignment") as data_dir:
+            self.prepare_translation_data(
+                data_dir, ["--align-suffix", "align"], alignment=True
+            )
+            train_translation_model(
+                data_dir,
+                "transformer_align",
+                [
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--load-alignments",
+                    "--alignment-layer",
+                    "1",
+                    "--criterion",
+                    "label_smoothed_cross_entropy_with_alignment",
+                ],
+                run_validation=True,
+            )
+            generate_main(data_dir)
 
     def test_laser_lstm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_laser_lstm") as data_dir:
-                laser_config_file = create_laser_data_and_config_json(data_dir)
-                train_translation_model(
-                    laser_config_file.name,
-                    "laser_lstm",
-                    [
-                        "--user-dir",
-                        "examples/laser/laser_src",
-                        "--weighting-alpha",
-                        "0.3",
-                        "--encoder-bidirectional",
-                        "--encoder-hidden-size",
-                        "512",
-                        "--encoder-layers",
-                        "5",
-                        "--decoder-layers",
-                        "1",
-                        "--encoder-embed-dim",
-                        "320",
-                        "--decoder-embed-dim",
-                        "320",
-                        "--decoder-lang-embed-dim",
-                        "32",
-                        "--save-dir",
-                        data_dir,
-                        "--disable-validation",
-                    ],
-                    task="laser",
-                    lang_flags=[],
-                )
+        with _tempdir("test_laser_lstm") as data_dir:
+            laser_config_file = create_laser_data_and_config_json(data_dir)
+            train_translation_model(
+                laser_config_file.name,
+                "laser_lstm",
+                [
+                    "--user-dir",
+                    "examples/laser/laser_src",
+                    "--weighting-alpha",
+                    "0.3",
+                    "--encoder-bidirectional",
+                    "--encoder-hidden-size",
+                    "512",
+                    "--encoder-layers",
+                    "5",
+                    "--decoder-layers",
+                    "1",
+                    "--encoder-embed-dim",
+                    "320",
+                    "--decoder-embed-dim",
+                    "320",
+                    "--decoder-lang-embed-dim",
+                    "32",
+                    "--save-dir",
+                    data_dir,
+                    "--disable-validation",
+                ],
+                task="laser",
+                lang_flags=[],
+                save_checkpoint=False,
+            )
 
     def test_laser_transformer(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_laser_transformer") as data_dir:
-                laser_config_file = create_laser_data_and_config_json(data_dir)
-                train_translation_model(
-                    laser_config_file.name,
-                    "laser_transformer",
-                    [
-                        "--user-dir",
-                        "examples/laser/laser_src",
-                        "--weighting-alpha",
-                        "0.3",
-                        "--encoder-embed-dim",
-                        "320",
-                        "--decoder-embed-dim",
-                        "320",
-                        "--decoder-lang-embed-dim",
-                        "32",
-                        "--save-dir",
-                        data_dir,
-                        "--disable-validation",
-                    ],
-                    task="laser",
-                    lang_flags=[],
-                )
+        with _tempdir("test_laser_transformer") as data_dir:
+            laser_config_file = create_laser_data_and_config_json(data_dir)
+            train_translation_model(
+                laser_config_file.name,
+                "laser_transformer",
+                [
+                    "--user-dir",
+                    "examples/laser/laser_src",
+                    "--weighting-alpha",
+                    "0.3",
+                    "--encoder-embed-dim",
+                    "320",
+                    "--decoder-embed-dim",
+                    "320",
+                    "--decoder-lang-embed-dim",
+                    "32",
+                    "--save-dir",
+                    data_dir,
+                    "--disable-validation",
+                ],
+                task="laser",
+                lang_flags=[],
+                save_checkpoint=False,
+            )
 
     def test_alignment_full_context(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_alignment") as data_dir:
-                create_dummy_data(data_dir, alignment=True)
-                preprocess_translation_data(data_dir, ["--align-suffix", "align"])
-                train_translation_model(
-                    data_dir,
-                    "transformer_align",
-                    [
-                        "--encoder-layers",
-                        "2",
-                        "--decoder-layers",
-                        "2",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--load-alignments",
-                        "--alignment-layer",
-                        "1",
-                        "--criterion",
-                        "label_smoothed_cross_entropy_with_alignment",
-                        "--full-context-alignment",
-                    ],
-                    run_validation=True,
-                )
-                generate_main(data_dir)
+        with _tempdir("test_alignment") as data_dir:
+            self.prepare_translation_data(
+                data_dir, ["--align-suffix", "align"], alignment=True
+            )
+            train_translation_model(
+                data_dir,
+                "transformer_align",
+                [
+                    "--encoder-layers",
+                    "2",
+                    "--decoder-layers",
+                    "2",
+                    "--encoder-embed-dim",
+                    "8",
+                    "--decoder-embed-dim",
+                    "8",
+                    "--load-alignments",
+                    "--alignment-layer",
+                    "1",
+                    "--criterion",
+                    "label_smoothed_cross_entropy_with_alignment",
+                    "--full-context-alignment",
+                ],
+                run_validation=True,
+            )
+            generate_main(data_dir)
 
     def test_transformer_layerdrop(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_transformer_layerdrop") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                train_translation_model(
-                    data_dir,
-                    "transformer_iwslt_de_en",
-                    [
-                        "--encoder-layers",
-                        "3",
-                        "--decoder-layers",
-                        "3",
-                        "--encoder-embed-dim",
-                        "8",
-                        "--decoder-embed-dim",
-                        "8",
-                        "--encoder-layerdrop",
-                        "0.01",
-                        "--decoder-layerdrop",
-                        "0.01",
-                    ],
-                )
-                generate_main(data_dir)
-                generate_main(
-                    data_dir,
-                    [
-                        "--model-overrides",
-                        "{'encoder_layers_to_keep':'0,2','decoder_layers_to_keep':'1'}",
-                    ],
-                )
-
-
-class TestStories(unittest.TestCase):
-    def setUp(self):
-        logging.disable(logging.CRITICAL)
-
-    def tearDown(self):
-        logging.disable(logging.NOTSET)
-
-    def test_fconv_self_att_wp(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_fconv_self_att_wp") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_translation_data(data_dir)
-                config = [
+        with _tempdir("test_transformer_layerdrop") as data_dir:
+            self.prepare_translation_data(data_dir)
+            train_translation_model(
+                data_dir,
+                "transformer_iwslt_de_en",
+                [
                     "--encoder-layers",
-                    "[(128, 3)] * 2",
+                    "3",
                     "--decoder-layers",
-                    "[(128, 3)] * 2",
-                    "--decoder-attention",
-                    "True",
-                    "--encoder-attention",
-                    "False",
-                    "--gated-attention",
-                    "True",
-                    "--self-attention",
-                    "True",
-                    "--project-input",
-                    "True",
+                    "3",
                     "--encoder-embed-dim",
                     "8",
                     "--decoder-embed-dim",
                     "8",
-                    "--decoder-out-embed-dim",
-                    "8",
-                    "--multihead-self-attention-nheads",
-                    "2",
-                ]
-                train_translation_model(data_dir, "fconv_self_att_wp", config)
-                generate_main(data_dir)
-
-                # fusion model
-                os.rename(
-                    os.path.join(data_dir, "checkpoint_last.pt"),
-                    os.path.join(data_dir, "pretrained.pt"),
-                )
-                config.extend(
-                    [
-                        "--pretrained",
-                        "True",
-                        "--pretrained-checkpoint",
-                        os.path.join(data_dir, "pretrained.pt"),
-                        "--save-dir",
-                        os.path.join(data_dir, "fusion_model"),
-                    ]
-                )
-                train_translation_model(data_dir, "fconv_self_att_wp", config)
+                    "--encoder-layerdrop",
+                    "0.01",
+                    "--decoder-layerdrop",
+                    "0.01",
+                ],
+            )
+            generate_main(data_dir)
+            generate_main(
+                data_dir,
+                [
+                    "--model-overrides",
+                    "{'encoder_layers_to_keep':'0,2','decoder_layers_to_keep':'1'}",
+                ],
+            )
 
 
-class TestLanguageModeling(unittest.TestCase):
-    def setUp(self):
-        logging.disable(logging.CRITICAL)
+class TestStories(BinaryTestCase):
+    @pytest.mark.slow
+    def test_fconv_self_att_wp(self):
+        with _tempdir("test_fconv_self_att_wp") as data_dir:
+            self.prepare_translation_data(data_dir)
+            config = [
+                "--encoder-layers",
+                "[(128, 3)] * 2",
+                "--decoder-layers",
+                "[(128, 3)] * 2",
+                "--decoder-attention",
+                "True",
+                "--encoder-attention",
+                "False",
+                "--gated-attention",
+                "True",
+                "--self-attention",
+                "True",
+                "--project-input",
+                "True",
+                "--encoder-embed-dim",
+                "8",
+                "--decoder-embed-dim",
+                "8",
+                "--decoder-out-embed-dim",
+                "8",
+                "--multihead-self-attention-nheads",
+                "2",
+            ]
+            train_translation_model(data_dir, "fconv_self_att_wp", config)
+            generate_main(data_dir)
+
+            # fusion model
+            os.rename(
+                os.path.join(data_dir, "checkpoint_last.pt"),
+                os.path.join(data_dir, "pretrained.pt"),
+            )
+            config.extend(
+                [
+                    "--pretrained",
+                    "True",
+                    "--pretrained-checkpoint",
+                    os.path.join(data_dir, "pretrained.pt"),
+                    "--save-dir",
+                    os.path.join(data_dir, "fusion_model"),
+                ]
+            )
+            train_translation_model(
+                data_dir, "fconv_self_att_wp", config, save_checkpoint=False
+            )
 
-    def tearDown(self):
-        logging.disable(logging.NOTSET)
 
+class TestLanguageModeling(BinaryTestCase):
     def test_fconv_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_fconv_lm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_language_model(
-                    data_dir,
-                    "fconv_lm",
-                    [
-                        "--decoder-layers",
-                        "[(850, 3)] * 2 + [(1024,4)]",
-                        "--decoder-embed-dim",
-                        "280",
-                        "--optimizer",
-                        "nag",
-                        "--lr",
-                        "0.1",
-                    ],
-                )
-                eval_lm_main(data_dir)
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "language_modeling",
-                        "--sample-break-mode",
-                        "eos",
-                        "--tokens-per-sample",
-                        "500",
-                    ],
-                )
+        with _tempdir("test_fconv_lm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_language_model(
+                data_dir,
+                "fconv_lm",
+                [
+                    "--decoder-layers",
+                    "[(850, 3)] * 2 + [(1024,4)]",
+                    "--decoder-embed-dim",
+                    "280",
+                    "--optimizer",
+                    "nag",
+                    "--lr",
+                    "0.1",
+                ],
+            )
+            eval_lm_main(data_dir)
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "language_modeling",
+                    "--sample-break-mode",
+                    "eos",
+                    "--tokens-per-sample",
+                    "500",
+                ],
+            )
 
     def test_transformer_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_transformer_lm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_language_model(
-                    data_dir,
-                    "transformer_lm",
-                    ["--add-bos-token", "--nval", "1"],
-                    run_validation=True,
-                )
-                eval_lm_main(data_dir)
-                eval_lm_main(data_dir, extra_flags=["--context-window", "25"])
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "language_modeling",
-                        "--sample-break-mode",
-                        "eos",
-                        "--tokens-per-sample",
-                        "500",
-                    ],
-                )
+        with _tempdir("test_transformer_lm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_language_model(
+                data_dir,
+                "transformer_lm",
+                ["--add-bos-token", "--nval", "1"],
+                run_validation=True,
+            )
+            eval_lm_main(data_dir)
+            eval_lm_main(data_dir, extra_flags=["--context-window", "25"])
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "language_modeling",
+                    "--sample-break-mode",
+                    "eos",
+                    "--tokens-per-sample",
+                    "500",
+                ],
+            )
 
     def test_normformer_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_transformer_lm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_language_model(
-                    data_dir,
-                    "transformer_lm",
-                    [
-                        "--add-bos-token",
-                        "--nval",
-                        "1",
-                        "--scale-fc",
-                        "--scale-heads",
-                        "--scale-attn",
-                        "--scale-fc",
-                    ],
-                    run_validation=True,
-                )
-                eval_lm_main(data_dir)
-                eval_lm_main(data_dir, extra_flags=["--context-window", "25"])
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "language_modeling",
-                        "--sample-break-mode",
-                        "eos",
-                        "--tokens-per-sample",
-                        "500",
-                    ],
-                )
+        with _tempdir("test_transformer_lm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_language_model(
+                data_dir,
+                "transformer_lm",
+                [
+                    "--add-bos-token",
+                    "--nval",
+                    "1",
+                    "--scale-fc",
+                    "--scale-heads",
+                    "--scale-attn",
+                    "--scale-fc",
+                ],
+                run_validation=True,
+            )
+            eval_lm_main(data_dir)
+            eval_lm_main(data_dir, extra_flags=["--context-window", "25"])
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "language_modeling",
+                    "--sample-break-mode",
+                    "eos",
+                    "--tokens-per-sample",
+                    "500",
+                ],
+            )
 
     def test_transformer_lm_with_adaptive_softmax(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_transformer_lm_with_adaptive_softmax"
-            ) as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_language_model(
-                    data_dir,
-                    "transformer_lm",
-                    [
-                        "--add-bos-token",
-                        "--criterion",
-                        "adaptive_loss",
-                        "--adaptive-softmax-cutoff",
-                        "5,10,15",
-                    ],
-                    run_validation=True,
-                )
-                eval_lm_main(data_dir)
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "language_modeling",
-                        "--sample-break-mode",
-                        "eos",
-                        "--tokens-per-sample",
-                        "500",
-                    ],
-                )
+        with _tempdir("test_transformer_lm_with_adaptive_softmax") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_language_model(
+                data_dir,
+                "transformer_lm",
+                [
+                    "--add-bos-token",
+                    "--criterion",
+                    "adaptive_loss",
+                    "--adaptive-softmax-cutoff",
+                    "5,10,15",
+                ],
+                run_validation=True,
+            )
+            eval_lm_main(data_dir)
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "language_modeling",
+                    "--sample-break-mode",
+                    "eos",
+                    "--tokens-per-sample",
+                    "500",
+                ],
+            )
 
     def test_lightconv_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_lightconv_lm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_language_model(
-                    data_dir,
-                    "lightconv_lm",
-                    ["--add-bos-token"],
-                    run_validation=True,
-                )
-                eval_lm_main(data_dir)
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "language_modeling",
-                        "--sample-break-mode",
-                        "eos",
-                        "--tokens-per-sample",
-                        "500",
-                    ],
-                )
+        with _tempdir("test_lightconv_lm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_language_model(
+                data_dir,
+                "lightconv_lm",
+                ["--add-bos-token"],
+                run_validation=True,
+            )
+            eval_lm_main(data_dir)
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "language_modeling",
+                    "--sample-break-mode",
+                    "eos",
+                    "--tokens-per-sample",
+                    "500",
+                ],
+            )
 
     def test_lstm_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_lstm_lm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_language_model(
-                    data_dir,
-                    "lstm_lm",
-                    ["--add-bos-token"],
-                    run_validation=True,
-                )
-                eval_lm_main(data_dir)
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "language_modeling",
-                        "--sample-break-mode",
-                        "eos",
-                        "--tokens-per-sample",
-                        "500",
-                    ],
-                )
+        with _tempdir("test_lstm_lm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_language_model(
+                data_dir,
+                "lstm_lm",
+                ["--add-bos-token"],
+                run_validation=True,
+            )
+            eval_lm_main(data_dir)
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "language_modeling",
+                    "--sample-break-mode",
+                    "eos",
+                    "--tokens-per-sample",
+                    "500",
+                ],
+            )
 
     def test_lstm_lm_residuals(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_lstm_lm_residuals") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_language_model(
-                    data_dir,
-                    "lstm_lm",
-                    ["--add-bos-token", "--residuals"],
-                    run_validation=True,
-                )
-                eval_lm_main(data_dir)
-                generate_main(
-                    data_dir,
-                    [
-                        "--task",
-                        "language_modeling",
-                        "--sample-break-mode",
-                        "eos",
-                        "--tokens-per-sample",
-                        "500",
-                    ],
-                )
+        with _tempdir("test_lstm_lm_residuals") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_language_model(
+                data_dir,
+                "lstm_lm",
+                ["--add-bos-token", "--residuals"],
+                run_validation=True,
+            )
+            eval_lm_main(data_dir)
+            generate_main(
+                data_dir,
+                [
+                    "--task",
+                    "language_modeling",
+                    "--sample-break-mode",
+                    "eos",
+                    "--tokens-per-sample",
+                    "500",
+                ],
+            )
 
     @unittest.skipIf(not has_hf_transformers, "skip test if transformers is missing")
     def test_transformer_xl_bptt_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_transformer_xl_bptt_lm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                task_flags = [
-                    "--user-dir",
-                    "examples/truncated_bptt",
-                    "--task",
-                    "truncated_bptt_lm",
-                    "--batch-size",
+        with _tempdir("test_transformer_xl_bptt_lm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            task_flags = [
+                "--user-dir",
+                "examples/truncated_bptt",
+                "--task",
+                "truncated_bptt_lm",
+                "--batch-size",
+                "2",
+                "--tokens-per-sample",
+                "50",
+            ]
+            train_language_model(
+                data_dir=data_dir,
+                arch="transformer_xl",
+                extra_flags=task_flags
+                + [
+                    "--n-layer",
                     "2",
-                    "--tokens-per-sample",
-                    "50",
-                ]
-                train_language_model(
-                    data_dir=data_dir,
-                    arch="transformer_xl",
-                    extra_flags=task_flags
-                    + [
-                        "--n-layer",
-                        "2",
-                    ],
-                    task="truncated_bptt_lm",
-                    run_validation=True,
-                    extra_valid_flags=task_flags,
-                )
-                eval_lm_main(data_dir, extra_flags=task_flags)
-                # Train with activation offloading
-                train_language_model(
-                    data_dir=data_dir,
-                    arch="transformer_xl",
-                    extra_flags=task_flags
-                    + [
-                        "--n-layer",
-                        "2",
-                        "--offload-activations",
-                    ],
-                    task="truncated_bptt_lm",
-                    run_validation=True,
-                    extra_valid_flags=task_flags,
-                )
-
-
-class TestMaskedLanguageModel(unittest.TestCase):
-    def setUp(self):
-        logging.disable(logging.CRITICAL)
+                ],
+                task="truncated_bptt_lm",
+                run_validation=True,
+                extra_valid_flags=task_flags,
+            )
+            eval_lm_main(data_dir, extra_flags=task_flags)
+            # Train with activation offloading
+            train_language_model(
+                data_dir=data_dir,
+                arch="transformer_xl",
+                extra_flags=task_flags
+                + [
+                    "--n-layer",
+                    "2",
+                    "--offload-activations",
+                ],
+                task="truncated_bptt_lm",
+                run_validation=True,
+                extra_valid_flags=task_flags,
+            )
 
-    def tearDown(self):
-        logging.disable(logging.NOTSET)
 
+class TestMaskedLanguageModel(BinaryTestCase):
     def test_legacy_masked_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_legacy_mlm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_legacy_masked_language_model(data_dir, "masked_lm")
+        with _tempdir("test_legacy_mlm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_legacy_masked_language_model(
+                data_dir, "masked_lm", save_checkpoint=False
+            )
 
     def test_roberta_masked_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_roberta_mlm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_masked_lm(
-                    data_dir, "roberta_base", extra_flags=["--encoder-layers", "2"]
-                )
+        with _tempdir("test_roberta_mlm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_masked_lm(
+                data_dir,
+                "roberta_base",
+                extra_flags=["--encoder-layers", "2"],
+                save_checkpoint=False,
+            )
 
     def test_roberta_sentence_prediction(self):
         num_classes = 3
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_roberta_head") as data_dir:
-                create_dummy_roberta_head_data(data_dir, num_classes=num_classes)
-                preprocess_lm_data(os.path.join(data_dir, "input0"))
-                preprocess_lm_data(os.path.join(data_dir, "label"))
-                train_roberta_head(data_dir, "roberta_base", num_classes=num_classes)
+        with _tempdir("test_roberta_head") as data_dir:
+            self.prepare_roberta_head_data(data_dir, num_classes)
+            train_roberta_head(
+                data_dir, "roberta_base", num_classes=num_classes, save_checkpoint=False
+            )
 
     def test_roberta_regression_single(self):
         num_classes = 1
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_roberta_regression_single"
-            ) as data_dir:
-                create_dummy_roberta_head_data(
-                    data_dir, num_classes=num_classes, regression=True
-                )
-                preprocess_lm_data(os.path.join(data_dir, "input0"))
-                train_roberta_head(
-                    data_dir,
-                    "roberta_base",
-                    num_classes=num_classes,
-                    extra_flags=["--regression-target"],
-                )
+        with _tempdir("test_roberta_regression_single") as data_dir:
+            self.prepare_roberta_head_data(data_dir, num_classes, regression=True)
+            train_roberta_head(
+                data_dir,
+                "roberta_base",
+                num_classes=num_classes,
+                extra_flags=["--regression-target"],
+                save_checkpoint=False,
+            )
 
     def test_roberta_regression_multiple(self):
         num_classes = 3
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_roberta_regression_multiple"
-            ) as data_dir:
-                create_dummy_roberta_head_data(
-                    data_dir, num_classes=num_classes, regression=True
-                )
-                preprocess_lm_data(os.path.join(data_dir, "input0"))
-                train_roberta_head(
-                    data_dir,
-                    "roberta_base",
-                    num_classes=num_classes,
-                    extra_flags=["--regression-target"],
-                )
+        with _tempdir("test_roberta_regression_multiple") as data_dir:
+            self.prepare_roberta_head_data(data_dir, num_classes, regression=True)
+            train_roberta_head(
+                data_dir,
+                "roberta_base",
+                num_classes=num_classes,
+                extra_flags=["--regression-target"],
+                save_checkpoint=False,
+            )
 
     def test_linformer_roberta_masked_lm(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_linformer_roberta_mlm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_masked_lm(
-                    data_dir,
-                    "linformer_roberta_base",
-                    extra_flags=[
-                        "--user-dir",
-                        "examples/linformer/linformer_src",
-                        "--encoder-layers",
-                        "2",
-                    ],
-                )
+        with _tempdir("test_linformer_roberta_mlm") as data_dir:
+            self.prepare_lm_data(data_dir)
+            train_masked_lm(
+                data_dir,
+                "linformer_roberta_base",
+                extra_flags=[
+                    "--user-dir",
+                    "examples/linformer/linformer_src",
+                    "--encoder-layers",
+                    "2",
+                ],
+                save_checkpoint=False,
+            )
 
     def test_linformer_roberta_sentence_prediction(self):
         num_classes = 3
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_linformer_roberta_head") as data_dir:
-                create_dummy_roberta_head_data(data_dir, num_classes=num_classes)
-                preprocess_lm_data(os.path.join(data_dir, "input0"))
-                preprocess_lm_data(os.path.join(data_dir, "label"))
-                train_roberta_head(
-                    data_dir,
-                    "linformer_roberta_base",
-                    num_classes=num_classes,
-                    extra_flags=["--user-dir", "examples/linformer/linformer_src"],
-                )
+        with _tempdir("test_linformer_roberta_head") as data_dir:
+            self.prepare_roberta_head_data(data_dir, num_classes)
+            train_roberta_head(
+                data_dir,
+                "linformer_roberta_base",
+                num_classes=num_classes,
+                extra_flags=["--user-dir", "examples/linformer/linformer_src"],
+                save_checkpoint=False,
+            )
 
     def test_linformer_roberta_regression_single(self):
         num_classes = 1
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_linformer_roberta_regression_single"
-            ) as data_dir:
-                create_dummy_roberta_head_data(
-                    data_dir, num_classes=num_classes, regression=True
-                )
-                preprocess_lm_data(os.path.join(data_dir, "input0"))
-                train_roberta_head(
-                    data_dir,
-                    "linformer_roberta_base",
-                    num_classes=num_classes,
-                    extra_flags=[
-                        "--regression-target",
-                        "--user-dir",
-                        "examples/linformer/linformer_src",
-                    ],
-                )
+        with _tempdir("test_linformer_roberta_regression_single") as data_dir:
+            self.prepare_roberta_head_data(data_dir, num_classes, regression=True)
+            train_roberta_head(
+                data_dir,
+                "linformer_roberta_base",
+                num_classes=num_classes,
+                extra_flags=[
+                    "--regression-target",
+                    "--user-dir",
+                    "examples/linformer/linformer_src",
+                ],
+                save_checkpoint=False,
+            )
 
     def test_linformer_roberta_regression_multiple(self):
         num_classes = 3
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory(
-                "test_linformer_roberta_regression_multiple"
-            ) as data_dir:
-                create_dummy_roberta_head_data(
-                    data_dir, num_classes=num_classes, regression=True
-                )
-                preprocess_lm_data(os.path.join(data_dir, "input0"))
-                train_roberta_head(
-                    data_dir,
-                    "linformer_roberta_base",
-                    num_classes=num_classes,
-                    extra_flags=[
-                        "--regression-target",
-                        "--user-dir",
-                        "examples/linformer/linformer_src",
-                    ],
-                )
+        with _tempdir("test_linformer_roberta_regression_multiple") as data_dir:
+            self.prepare_roberta_head_data(data_dir, num_classes, regression=True)
+            train_roberta_head(
+                data_dir,
+                "linformer_roberta_base",
+                num_classes=num_classes,
+                extra_flags=[
+                    "--regression-target",
+                    "--user-dir",
+                    "examples/linformer/linformer_src",
+                ],
+                save_checkpoint=False,
+            )
+
+    pretrained_xlm_flags = [
+        "--decoder-layers",
+        "1",
+        "--decoder-embed-dim",
+        "32",
+        "--decoder-attention-heads",
+        "1",
+        "--decoder-ffn-embed-dim",
+        "32",
+        "--encoder-layers",
+        "1",
+        "--encoder-embed-dim",
+        "32",
+        "--encoder-attention-heads",
+        "1",
+        "--encoder-ffn-embed-dim",
+        "32",
+        "--activation-fn",
+        "gelu",
+        "--max-source-positions",
+        "500",
+        "--max-target-positions",
+        "500",
+    ]
+
+    def _pretrained_masked_lm(self, learned_pos_emb):
+        """Path to a legacy masked LM checkpoint. The translation tests below
+        only read it, so it is trained once per class for each kind of
+        positional embedding."""
+        key = ("masked_lm", learned_pos_emb)
+        if key not in self._models:
+            name = f"model{len(self._models)}"
+            model_dir = os.path.join(self._models_dir.name, name)
+            self.prepare_lm_data(model_dir)
+            train_legacy_masked_language_model(
+                model_dir,
+                arch="masked_lm",
+                extra_args=("--encoder-learned-pos",) if learned_pos_emb else (),
+            )
+            self._models[key] = os.path.join(model_dir, "checkpoint_last.pt")
+        return self._models[key]
 
     def _test_pretrained_masked_lm_for_translation(self, learned_pos_emb, encoder_only):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_mlm") as data_dir:
-                create_dummy_data(data_dir)
-                preprocess_lm_data(data_dir)
-                train_legacy_masked_language_model(
-                    data_dir,
-                    arch="masked_lm",
-                    extra_args=("--encoder-learned-pos",) if learned_pos_emb else (),
-                )
-                with tempfile.TemporaryDirectory(
-                    "test_mlm_translation"
-                ) as translation_dir:
-                    create_dummy_data(translation_dir)
-                    preprocess_translation_data(
-                        translation_dir, extra_flags=["--joined-dictionary"]
-                    )
-                    # Train transformer with data_dir/checkpoint_last.pt
-                    train_translation_model(
-                        translation_dir,
-                        arch="transformer_from_pretrained_xlm",
-                        extra_flags=[
-                            "--decoder-layers",
-                            "1",
-                            "--decoder-embed-dim",
-                            "32",
-                            "--decoder-attention-heads",
-                            "1",
-                            "--decoder-ffn-embed-dim",
-                            "32",
-                            "--encoder-layers",
-                            "1",
-                            "--encoder-embed-dim",
-                            "32",
-                            "--encoder-attention-heads",
-                            "1",
-                            "--encoder-ffn-embed-dim",
-                            "32",
-                            "--pretrained-xlm-checkpoint",
-                            "{}/checkpoint_last.pt".format(data_dir),
-                            "--activation-fn",
-                            "gelu",
-                            "--max-source-positions",
-                            "500",
-                            "--max-target-positions",
-                            "500",
-                        ]
-                        + (
-                            ["--encoder-learned-pos", "--decoder-learned-pos"]
-                            if learned_pos_emb
-                            else []
-                        )
-                        + (["--init-encoder-only"] if encoder_only else []),
-                        task="translation_from_pretrained_xlm",
-                    )
+        checkpoint = self._pretrained_masked_lm(learned_pos_emb)
+        with _tempdir("test_mlm_translation") as translation_dir:
+            self.prepare_translation_data(translation_dir, ["--joined-dictionary"])
+            # Train transformer with the pretrained checkpoint
+            train_translation_model(
+                translation_dir,
+                arch="transformer_from_pretrained_xlm",
+                extra_flags=self.pretrained_xlm_flags
+                + ["--pretrained-xlm-checkpoint", checkpoint]
+                + (
+                    ["--encoder-learned-pos", "--decoder-learned-pos"]
+                    if learned_pos_emb
+                    else []
+                )
+                + (["--init-encoder-only"] if encoder_only else []),
+                task="translation_from_pretrained_xlm",
+                save_checkpoint=False,
+            )
 
     def test_pretrained_masked_lm_for_translation_learned_pos_emb(self):
         self._test_pretrained_masked_lm_for_translation(True, False)
@@ -1571,27 +1636,27 @@ class TestMaskedLanguageModel(unittest.TestCase):
 
     def test_r4f_roberta(self):
         num_classes = 3
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_r4f_roberta_head") as data_dir:
-                create_dummy_roberta_head_data(data_dir, num_classes=num_classes)
-                preprocess_lm_data(os.path.join(data_dir, "input0"))
-                preprocess_lm_data(os.path.join(data_dir, "label"))
-                train_roberta_head(
-                    data_dir,
-                    "roberta_base",
-                    num_classes=num_classes,
-                    extra_flags=[
-                        "--user-dir",
-                        "examples/rxf/rxf_src",
-                        "--criterion",
-                        "sentence_prediction_r3f",
-                        "--spectral-norm-classification-head",
-                    ],
-                )
+        with _tempdir("test_r4f_roberta_head") as data_dir:
+            self.prepare_roberta_head_data(data_dir, num_classes)
+            train_roberta_head(
+                data_dir,
+                "roberta_base",
+                num_classes=num_classes,
+                extra_flags=[
+                    "--user-dir",
+                    "examples/rxf/rxf_src",
+                    "--criterion",
+                    "sentence_prediction_r3f",
+                    "--spectral-norm-classification-head",
+                ],
+                save_checkpoint=False,
+            )
 
 
-def train_legacy_masked_language_model(data_dir, arch, extra_args=()):
-    train_parser = options.get_training_parser()
+def train_legacy_masked_language_model(
+    data_dir, arch, extra_args=(), save_checkpoint=True
+):
+    train_parser = fresh_parser("training")
     # TODO: langs should be in and out right?
     train_args = options.parse_args_and_arch(
         train_parser,
@@ -1651,29 +1716,21 @@ def train_legacy_masked_language_model(data_dir, arch, extra_args=()):
             "--num-workers",
             "0",
         ]
+        + ([] if save_checkpoint else ["--no-save"])
         + list(extra_args),
     )
     train.main(train_args)
 
 
-class TestOptimizers(unittest.TestCase):
-    def setUp(self):
-        logging.disable(logging.CRITICAL)
-
-    def tearDown(self):
-        logging.disable(logging.NOTSET)
-
+class TestOptimizers(BinaryTestCase):
     def test_optimizers(self):
-        with contextlib.redirect_stdout(StringIO()):
-            with tempfile.TemporaryDirectory("test_optimizers") as data_dir:
-                # Use just a bit of data and tiny model to keep this test runtime reasonable
-                create_dummy_data(data_dir, num_examples=10, maxlen=5)
-                preprocess_translation_data(data_dir)
-                optimizers = ["adafactor", "adam", "nag", "adagrad", "sgd", "adadelta"]
-                last_checkpoint = os.path.join(data_dir, "checkpoint_last.pt")
-                for optimizer in optimizers:
-                    if os.path.exists(last_checkpoint):
-                        os.remove(last_checkpoint)
+        optimizers = ["adafactor", "adam", "nag", "adagrad", "sgd", "adadelta"]
+        for optimizer in optimizers:
+            with self.subTest(optimizer=optimizer):
+                with _tempdir(f"test_optimizers_{optimizer}") as data_dir:
+                    # Use just a bit of data and tiny model to keep this test
+                    # runtime reasonable
+                    self.prepare_translation_data(data_dir, num_examples=10, maxlen=5)
                     train_translation_model(
                         data_dir,
                         "lstm",
@@ -1723,6 +1780,14 @@ class TestActivationCheckpointing(unittest.TestCase):
     ]
 
     def _train(self, data_dir, extra_flags):
+        """Train a 2-layer model for two updates and return the captured logs.
+
+        This only checks that recomputing (or offloading) activations does not
+        change the loss; it says nothing about memory or speed. Note that
+        ``--checkpoint-activations`` checkpoints every layer, whereas for deep
+        models the compute/memory optimum is to keep about one activation every
+        sqrt(num_layers) layers.
+        """
         with self.assertLogs() as logs:
             train_translation_model(
                 data_dir,
@@ -1735,11 +1800,9 @@ class TestActivationCheckpointing(unittest.TestCase):
 
     def test_activation_offloading_does_not_change_metrics(self):
         """Neither ----checkpoint-activations nor --offload-activations should change loss"""
-        with tempfile.TemporaryDirectory("test_transformer_with_act_cpt") as data_dir:
+        with _tempdir("test_transformer_with_act_cpt") as data_dir:
 
-            with self.assertLogs():
-                create_dummy_data(data_dir, num_examples=20)
-                preprocess_translation_data(data_dir)
+            _prepare_corpus(data_dir, "translation", num_examples=20)
             offload_logs = self._train(data_dir, ["--offload-activations"])
             baseline_logs = self._train(data_dir, [])
 
@@ -1760,10 +1823,8 @@ class TestActivationCheckpointing(unittest.TestCase):
     def test_activation_checkpointing_does_not_change_metrics(self):
         """--checkpoint-activations should not change loss"""
 
-        with tempfile.TemporaryDirectory("test_transformer_with_act_cpt") as data_dir:
-            with self.assertLogs():
-                create_dummy_data(data_dir, num_examples=20)
-                preprocess_translation_data(data_dir)
+        with _tempdir("test_transformer_with_act_cpt") as data_dir:
+            _prepare_corpus(data_dir, "translation", num_examples=20)
             ckpt_logs = self._train(data_dir, ["--checkpoint-activations"])
             baseline_logs = self._train(data_dir, [])
             assert len(baseline_logs) == len(ckpt_logs)
@@ -1783,29 +1844,18 @@ def create_dummy_roberta_head_data(
     input_dir = "input0"
 
     def _create_dummy_data(filename):
-        random_data = torch.rand(num_examples * maxlen)
-        input_data = 97 + torch.floor(26 * random_data).int()
+        inputs = dummy_lines(num_examples, maxlen)
         if regression:
-            output_data = torch.rand((num_examples, num_classes))
+            output_data = torch.rand((num_examples, num_classes)).numpy()
+            labels = [" ".join(map(str, row)) for row in output_data]
         else:
-            output_data = 1 + torch.floor(num_classes * torch.rand(num_examples)).int()
+            output_data = torch.randint(1, num_classes + 1, (num_examples,))
+            labels = [f"class{c}" for c in output_data.tolist()]
+        label_filename = filename + ".label" if regression else filename + ".out"
         with open(os.path.join(data_dir, input_dir, filename + ".out"), "w") as f_in:
-            label_filename = filename + ".label" if regression else filename + ".out"
-            with open(os.path.join(data_dir, "label", label_filename), "w") as f_out:
-                offset = 0
-                for i in range(num_examples):
-                    # write example input
-                    ex_len = random.randint(1, maxlen)
-                    ex_str = " ".join(map(chr, input_data[offset : offset + ex_len]))
-                    print(ex_str, file=f_in)
-                    # write example label
-                    if regression:
-                        class_str = " ".join(map(str, output_data[i].numpy()))
-                        print(class_str, file=f_out)
-                    else:
-                        class_str = "class{}".format(output_data[i])
-                        print(class_str, file=f_out)
-                    offset += ex_len
+            f_in.write("\n".join(inputs) + "\n")
+        with open(os.path.join(data_dir, "label", label_filename), "w") as f_out:
+            f_out.write("\n".join(labels) + "\n")
 
     os.mkdir(os.path.join(data_dir, input_dir))
     os.mkdir(os.path.join(data_dir, "label"))
@@ -1814,8 +1864,26 @@ def create_dummy_roberta_head_data(
     _create_dummy_data("test")
 
 
-def train_masked_lm(data_dir, arch, extra_flags=None):
-    train_parser = options.get_training_parser()
+# one epoch of Adam in a single process, shared by the helpers below
+_SHORT_TRAINING_FLAGS = [
+    "--optimizer",
+    "adam",
+    "--lr",
+    "0.0001",
+    "--max-epoch",
+    "1",
+    "--no-progress-bar",
+    "--distributed-world-size",
+    "1",
+    "--ddp-backend",
+    "no_c10d",
+    "--num-workers",
+    "0",
+]
+
+
+def train_masked_lm(data_dir, arch, extra_flags=None, save_checkpoint=True):
+    train_parser = fresh_parser("training")
     train_args = options.parse_args_and_arch(
         train_parser,
         [
@@ -1824,10 +1892,6 @@ def train_masked_lm(data_dir, arch, extra_flags=None):
             data_dir,
             "--arch",
             arch,
-            "--optimizer",
-            "adam",
-            "--lr",
-            "0.0001",
             "--criterion",
             "masked_lm",
             "--batch-size",
@@ -1836,23 +1900,18 @@ def train_masked_lm(data_dir, arch, extra_flags=None):
             "1",
             "--save-dir",
             data_dir,
-            "--max-epoch",
-            "1",
-            "--no-progress-bar",
-            "--distributed-world-size",
-            "1",
-            "--ddp-backend",
-            "no_c10d",
-            "--num-workers",
-            "0",
         ]
+        + _SHORT_TRAINING_FLAGS
+        + ([] if save_checkpoint else ["--no-save"])
         + (extra_flags or []),
     )
     train.main(train_args)
 
 
-def train_roberta_head(data_dir, arch, num_classes=2, extra_flags=None):
-    train_parser = options.get_training_parser()
+def train_roberta_head(
+    data_dir, arch, num_classes=2, extra_flags=None, save_checkpoint=True
+):
+    train_parser = fresh_parser("training")
     train_args = options.parse_args_and_arch(
         train_parser,
         [
@@ -1865,10 +1924,6 @@ def train_roberta_head(data_dir, arch, num_classes=2, extra_flags=None):
             "2",
             "--num-classes",
             str(num_classes),
-            "--optimizer",
-            "adam",
-            "--lr",
-            "0.0001",
             "--criterion",
             "sentence_prediction",
             "--max-tokens",
@@ -1879,23 +1934,16 @@ def train_roberta_head(data_dir, arch, num_classes=2, extra_flags=None):
             "500",
             "--save-dir",
             data_dir,
-            "--max-epoch",
-            "1",
-            "--no-progress-bar",
-            "--distributed-world-size",
-            "1",
-            "--ddp-backend",
-            "no_c10d",
-            "--num-workers",
-            "0",
         ]
+        + _SHORT_TRAINING_FLAGS
+        + ([] if save_checkpoint else ["--no-save"])
         + (extra_flags or []),
     )
     train.main(train_args)
 
 
 def eval_lm_main(data_dir, extra_flags=None):
-    eval_lm_parser = options.get_eval_lm_parser()
+    eval_lm_parser = fresh_parser("eval_lm")
     eval_lm_args = options.parse_args_and_arch(
         eval_lm_parser,
         [
@@ -1911,5 +1959,30 @@ def eval_lm_main(data_dir, extra_flags=None):
     eval_lm.main(eval_lm_args)
 
 
+def validate_main(data_dir, extra_flags=None):
+    validate_parser = fresh_parser("validation")
+    validate_args = options.parse_args_and_arch(
+        validate_parser,
+        [
+            data_dir,
+            "--path",
+            os.path.join(data_dir, "checkpoint_last.pt"),
+            "--source-lang",
+            "in",
+            "--target-lang",
+            "out",
+            "--max-tokens",
+            "500",
+            "--no-progress-bar",
+            "--num-workers",
+            "0",
+        ]
+        + (extra_flags or []),
+    )
+    validate.main(validate_args)
+
+
 if __name__ == "__main__":
-    unittest.main()
+    # run through pytest so the slow marker and extra options such as
+    # ``-n auto`` (pytest-xdist) apply when the file is run directly
+    sys.exit(pytest.main([__file__] + sys.argv[1:]))
@@ -7,7 +7,18 @@ import logging
 import unittest
 from typing import Sequence
 
-from fairseq.data import LanguagePairDataset, ListDataset, RoundRobinZipDatasets
+import numpy as np
+import torch
+
+from fairseq.data import (
+    ConcatSentencesDataset,
+    LanguagePairDataset,
+    ListDataset,
+    PrependConcatTruncateDataset,
+    PrependTokenDataset,
+    RoundRobinZipDatasets,
+    TruncateDataset,
+)
 from tests.test_train import mock_dict
 
 
@@ -64,3 +75,34 @@ class TestDataset(unittest.TestCase):
         self.assertEqual(dict(dataset[0]), {"a": sample(5, 7), "b": sample(2, 9)})
         self.assertEqual(dict(dataset[2]), {"a": sample(0, 10), "b": sample(2, 9)})
         self.assertEqual(dict(dataset[4]), {"a": sample(6, 12), "b": sample(2, 9)})
+
+    def test_prepend_concat_truncate_dataset(self):
+        def list_dataset(lengths, offset):
+            tokens = [torch.arange(offset, offset + n) for n in lengths]
+            return ListDataset(tokens, np.array(lengths))
+
+        first = list_dataset([3, 1, 6, 0], offset=10)
+        second = list_dataset([2, 4, 0, 5], offset=20)
+        for prepend_token, sep_token, max_len in [
+            (None, None, None),
+            (0, 2, None),
+            (0, 2, 4),
+            (None, 2, 2),
+            (0, None, 3),
+        ]:
+            expected = PrependTokenDataset(first, prepend_token)
+            if max_len is not None:
+                expected = TruncateDataset(expected, max_len)
+            expected = ConcatSentencesDataset(
+                expected, PrependTokenDataset(second, sep_token)
+            )
+            dataset = PrependConcatTruncateDataset(
+                first,
+                second,
+                prepend_token=prepend_token,
+                sep_token=sep_token,
+                max_len=max_len,
+            )
+            self.assertEqual(list(dataset.sizes), list(expected.sizes))
+            for i in range(len(dataset)):
+                self.assertEqual(dataset[i].tolist(), expected[i].tolist())
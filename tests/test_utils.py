@@ -105,6 +105,32 @@ class TestUtils(unittest.TestCase):
         resolved = utils.resolve_max_positions(None, (2000, 100, 2000), 12000)
         self.assertEqual(resolved, (2000, 100, 2000))
 
+    @unittest.skipIf(not torch.cuda.is_available(), "test requires a GPU")
+    def test_fast_move_to_cuda(self):
+        tokens = torch.arange(12).view(3, 4)
+        sample = {
+            "id": torch.LongTensor([0, 1, 2]),
+            "net_input": {"src_tokens": tokens.t(), "src_lengths": tokens[:, 0]},
+            "mask": [torch.rand(3, 4) > 0.5, torch.zeros(0, dtype=torch.bool)],
+            "source": torch.rand(3, 5),
+            "ntokens": 12,
+        }
+        moved = utils.fast_move_to_cuda(sample)
+
+        self.assertEqual(moved["ntokens"], 12)
+        pairs = [
+            (moved["id"], sample["id"]),
+            (moved["net_input"]["src_tokens"], sample["net_input"]["src_tokens"]),
+            (moved["net_input"]["src_lengths"], sample["net_input"]["src_lengths"]),
+            (moved["mask"][0], sample["mask"][0]),
+            (moved["mask"][1], sample["mask"][1]),
+            (moved["source"], sample["source"]),
+        ]
+        for x, y in pairs:
+            self.assertTrue(x.is_cuda)
+            self.assertEqual(x.dtype, y.dtype)
+            self.assertTrue(torch.equal(x.cpu(), y))
+
     def assertAlmostEqual(self, t1, t2):
         self.assertEqual(t1.size(), t2.size(), "size mismatch")
         self.assertLess(utils.item((t1 - t2).abs().max()), 1e-4)
@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
+import functools
 import json
 import os
 import random
@@ -31,6 +32,21 @@ from fairseq.tasks import LegacyFairseqTask
 from fairseq_cli import generate, interactive, preprocess, train, validate
 
 
+@functools.lru_cache(maxsize=None)
+def _base_parser(name):
+    return getattr(options, f"get_{name}_parser")()
+
+
+def fresh_parser(name):
+    """Equivalent to ``options.get_<name>_parser()``, but built from a parser
+    cached across calls. ``parse_args_and_arch`` adds task and model arguments
+    to the parser it is given, so every call gets a new child of the cached
+    one rather than the cached parser itself."""
+    return argparse.ArgumentParser(
+        parents=[_base_parser(name)], add_help=False, allow_abbrev=False
+    )
+
+
 def dummy_dictionary(vocab_size, prefix="token_"):
     d = Dictionary()
     for i in range(vocab_size):
@@ -166,19 +182,29 @@ def sequence_generator_setup():
     return tgt_dict, w1, w2, src_tokens, src_lengths, model
 
 
+def dummy_lines(num_examples, maxlen):
+    """Return *num_examples* lines of 1 to *maxlen* space-separated random
+    characters (a-z)."""
+    # sample all lengths and characters at once, then cut the lines out of a
+    # single string
+    lengths = torch.randint(1, maxlen + 1, (num_examples,)).tolist()
+    data = torch.randint(97, 123, (sum(lengths),), dtype=torch.uint8)
+    data = bytes(data.tolist()).decode("ascii")
+    lines = []
+    offset = 0
+    for ex_len in lengths:
+        lines.append(" ".join(data[offset : offset + ex_len]))
+        offset += ex_len
+    return lines
+
+
 def create_dummy_data(
     data_dir, num_examples=100, maxlen=20, alignment=False, languages=None
 ):
     def _create_dummy_data(dir, filename):
-        data = torch.rand(num_examples * maxlen)
-        data = 97 + torch.floor(26 * data).int()
+        lines = dummy_lines(num_examples, maxlen)
         with open(os.path.join(dir, filename), "w") as h:
-            offset = 0
-            for _ in range(num_examples):
-                ex_len = random.randint(1, maxlen)
-                ex_str = " ".join(map(chr, data[offset : offset + ex_len]))
-                print(ex_str, file=h)
-                offset += ex_len
+            h.write("\n".join(lines) + "\n")
 
     def _create_dummy_alignment_data(filename_src, filename_tgt, filename):
         with open(os.path.join(data_dir, filename_src), "r") as src_f, open(
@@ -189,8 +215,8 @@ def create_dummy_data(
                 tgt_len = len(tgt.split())
                 avg_len = (src_len + tgt_len) // 2
                 num_alignments = random.randint(avg_len // 2, 2 * avg_len)
-                src_indices = torch.floor(torch.rand(num_alignments) * src_len).int()
-                tgt_indices = torch.floor(torch.rand(num_alignments) * tgt_len).int()
+                src_indices = torch.randint(src_len, (num_alignments,)).tolist()
+                tgt_indices = torch.randint(tgt_len, (num_alignments,)).tolist()
                 ex_str = " ".join(
                     [
                         "{}-{}".format(src, tgt)
@@ -224,7 +250,7 @@ def create_dummy_data(
 
 
 def preprocess_lm_data(data_dir, languages=None):
-    preprocess_parser = options.get_preprocessing_parser()
+    preprocess_parser = fresh_parser("preprocessing")
     if languages is None:
         preprocess_args = preprocess_parser.parse_args(
             [
@@ -265,7 +291,7 @@ def preprocess_lm_data(data_dir, languages=None):
 
 
 def preprocess_translation_data(data_dir, extra_flags=None):
-    preprocess_parser = options.get_preprocessing_parser()
+    preprocess_parser = fresh_parser("preprocessing")
     preprocess_args = preprocess_parser.parse_args(
         [
             "--source-lang",
@@ -291,7 +317,7 @@ def preprocess_translation_data(data_dir, extra_flags=None):
 
 
 def preprocess_summarization_data(data_dir, extra_flags=None):
-    preprocess_parser = options.get_preprocessing_parser()
+    preprocess_parser = fresh_parser("preprocessing")
     preprocess_args = preprocess_parser.parse_args(
         [
             "--source-lang",
@@ -363,7 +389,9 @@ def train_translation_model(
     lang_flags=None,
     extra_valid_flags=None,
     world_size=1,
+    save_checkpoint=True,
 ):
+    assert save_checkpoint or not run_validation, "validation needs a checkpoint"
     if lang_flags is None:
         lang_flags = [
             "--source-lang",
@@ -371,7 +399,7 @@ def train_translation_model(
             "--target-lang",
             "out",
         ]
-    train_parser = options.get_training_parser()
+    train_parser = fresh_parser("training")
     train_args = options.parse_args_and_arch(
         train_parser,
         [
@@ -397,6 +425,7 @@ def train_translation_model(
             "0",
         ]
         + lang_flags
+        + ([] if save_checkpoint else ["--no-save"])
         + (extra_flags or []),
     )
 
@@ -405,7 +434,7 @@ def train_translation_model(
 
     if run_validation:
         # test validation
-        validate_parser = options.get_validation_parser()
+        validate_parser = fresh_parser("validation")
         validate_args = options.parse_args_and_arch(
             validate_parser,
             [
@@ -418,6 +447,8 @@ def train_translation_model(
                 "valid",
                 "--max-tokens",
                 "500",
+                "--max-valid-steps",
+                "1",
                 "--no-progress-bar",
                 "--num-workers",
                 "0",
@@ -435,7 +466,7 @@ def generate_main(data_dir, extra_flags=None, path=None):
         ]
     if path is None:
         path = os.path.join(data_dir, "checkpoint_last.pt")
-    generate_parser = options.get_generation_parser()
+    generate_parser = fresh_parser("generation")
     generate_args = options.parse_args_and_arch(
         generate_parser,
         [
@@ -702,7 +733,7 @@ def train_language_model(
     task="language_modeling",
     world_size=1,
 ):
-    train_parser = options.get_training_parser()
+    train_parser = fresh_parser("training")
     train_args = options.parse_args_and_arch(
         train_parser,
         [
@@ -738,7 +769,7 @@ def train_language_model(
 
     if run_validation:
         # test validation
-        validate_parser = options.get_validation_parser()
+        validate_parser = fresh_parser("validation")
         validate_args = options.parse_args_and_arch(
             validate_parser,
             [
@@ -751,6 +782,8 @@ def train_language_model(
                 "valid",
                 "--max-tokens",
                 "500",
+                "--max-valid-steps",
+                "1",
                 "--no-progress-bar",
                 "--num-workers",
                 "0",